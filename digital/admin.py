@@ -26,7 +26,7 @@ class CategoryAdmin(admin.ModelAdmin):
     def get_image(self, obj):
         if obj.image:
             try:
-                return mark_safe(f'<img src="{obj.image.url}" width="75" >')
+                return mark_safe(f'<img src="{obj.get_image_category()}" width="75" >')
             except:
                 return '-'
         else:
@@ -43,28 +43,33 @@ class BrandAdmin(admin.ModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('pk', 'title', 'category', 'quantity', 'price', 'created_at', 'brand', 'get_image')
+    list_display = ('pk', 'title', 'category', 'quantity', 'reserved', 'price', 'created_at', 'brand', 'get_image')
     list_display_links = ('pk', 'title')
     prepopulated_fields = {'slug': ['title']}
     inlines = [GalleryInline, ParameterInline]
     list_editable = ['quantity', 'price']
+    readonly_fields = ['reserved']  # Меняется только корзинами (stock.py)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('category', 'brand').prefetch_related('images')
 
+    # В списке товаров показываем маленькую копию картинки, а не оригинал
     def get_image(self, obj):
-        if obj.images:
-            try:
-                return mark_safe(f'<img src="{obj.images.all()[0].image.url}" width="75" >')
-            except:
-                return '-'
+        image_url = obj.get_image_product('thumb')
+        if image_url != '-':
+            return mark_safe(f'<img src="{image_url}" width="75" >')
         else:
             return '-'
 
+    get_image.short_description = 'Картинка'
+
 
 # admin.site.register(Category)
 # admin.site.register(Product)
 admin.site.register(ProductDescription)
 admin.site.register(Gallery)
 admin.site.register(FavoriteProduct)
+admin.site.register(CategoryFacet)
 # admin.site.register(Brand)
 
 
@@ -72,4 +77,11 @@ admin.site.register(Customer)
 admin.site.register(Order)
 admin.site.register(OrderProduct)
 admin.site.register(ShippingAddress)
-admin.site.register(City)
\ No newline at end of file
+admin.site.register(City)
+
+
+@admin.register(PaymentEvent)
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'type', 'event_id', 'received_at', 'processed_at', 'attempts')
+    list_filter = ('type', 'processed_at')
+    readonly_fields = ('event_id', 'type', 'payload', 'received_at', 'processed_at', 'attempts', 'error')
\ No newline at end of file
@@ -0,0 +1,109 @@
+import os
+import re
+
+from django.conf import settings
+
+# Сборка статики для продакшена (команда build_static): CSS склеивается в один минифицированный файл,
+# шрифты TTF дополнительно конвертируются в WOFF2. Результат пишется в digital/static/digital/dist,
+# откуда его забирает collectstatic
+
+SOURCE_DIR = settings.BASE_DIR / 'digital' / 'static'
+DIST_DIR = SOURCE_DIR / 'digital' / 'dist'
+
+CSS_BUNDLE = 'site.css'
+CSS_FILES = [
+    'digital/css/style.css',
+    'digital/css/swiper.css',
+    'digital/css/media.css',
+]
+
+# Символы которые остаются в шрифтах: латиница, кириллица, знаки препинания, валюты
+FONT_UNICODES = [*range(0x20, 0x7f), *range(0xa0, 0x100), *range(0x400, 0x460), *range(0x2010, 0x2030),
+                 0x20bd, 0x2116]
+
+IMPORT_RE = re.compile(r'@import\s+(?:url\()?\s*[\'"]?([^\'")]+)[\'"]?\s*\)?\s*;')
+URL_RE = re.compile(r'url\(\s*[\'"]?([^\'")]+)[\'"]?\s*\)')
+TTF_URL_RE = re.compile(r'url\(([^)]+)\.ttf\)')
+
+
+# Функция читает CSS файл вместе с @import, относительные url() переписываются от папки бандла
+def read_css(name, seen=None):
+    seen = seen if seen is not None else set()
+    if name in seen:
+        return ''
+    seen.add(name)
+    directory = os.path.dirname(name)
+    with open(SOURCE_DIR / name, encoding='utf-8') as file:
+        css = file.read()
+
+    def rewrite_url(match):
+        url = match.group(1)
+        if url.startswith(('data:', 'http:', 'https:', '/', '#')):
+            return match.group(0)
+        path = os.path.normpath(os.path.join(directory, url)).replace(os.sep, '/')
+        return f'url({os.path.relpath(path, "digital/dist").replace(os.sep, "/")})'
+
+    # @import должны быть в начале файла, поэтому вставленные файлы идут перед остальным CSS
+    imports = [
+        read_css(os.path.normpath(os.path.join(directory, match.group(1))).replace(os.sep, '/'), seen)
+        for match in IMPORT_RE.finditer(css)
+    ]
+    css = URL_RE.sub(rewrite_url, IMPORT_RE.sub('', css))
+    return '\n'.join(imports + [css])
+
+
+# Простая минификация CSS: убираются комментарии, лишние пробелы и последняя точка с запятой в блоке
+def minify_css(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r'\s+:(?=[^{}]*})', ':', css)  # Только в объявлениях: в селекторе "a :hover" пробел значим
+    css = re.sub(r':\s+', ':', css)
+    css = css.replace(';}', '}')
+    return css.strip()
+
+
+# Функция конвертирует шрифты TTF в WOFF2 с набором символов FONT_UNICODES.
+# Нужны необязательные пакеты fonttools и brotli, без них остаются TTF
+def build_woff2_fonts(output_dir):
+    try:
+        from fontTools import subset
+        import brotli  # noqa: F401 - нужен fontTools для сжатия WOFF2
+    except ImportError:
+        return []
+
+    fonts = []
+    os.makedirs(output_dir / 'fonts', exist_ok=True)
+    for name in sorted(os.listdir(SOURCE_DIR / 'digital' / 'fonts')):
+        if not name.endswith('.ttf'):
+            continue
+        options = subset.Options()
+        options.flavor = 'woff2'
+        options.layout_features = ['*']
+        font = subset.load_font(SOURCE_DIR / 'digital' / 'fonts' / name, options)
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(unicodes=FONT_UNICODES)
+        subsetter.subset(font)
+        subset.save_font(font, output_dir / 'fonts' / name.replace('.ttf', '.woff2'), options)
+        fonts.append(name)
+    return fonts
+
+
+# Функция собирает бандл CSS (и шрифты WOFF2), возвращает путь к бандлу
+def build_css_bundle(output_dir=DIST_DIR):
+    os.makedirs(output_dir, exist_ok=True)
+    css = minify_css('\n'.join(read_css(name) for name in CSS_FILES))
+
+    fonts = build_woff2_fonts(output_dir)
+    if fonts:
+        # ../fonts/X.ttf -> fonts/X.woff2 со старым TTF как запасным вариантом
+        css = TTF_URL_RE.sub(
+            lambda match: f"url(fonts/{os.path.basename(match.group(1))}.woff2) format('woff2'),"
+                          f"url({match.group(1)}.ttf) format('truetype')",
+            css
+        )
+
+    path = output_dir / CSS_BUNDLE
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(css)
+    return path
@@ -0,0 +1,378 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+import tempfile
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+
+from .models import Brand, Category, Product
+
+# Подсказки поиска хранятся в файле-снимке, который все процессы сервера открывают через mmap:
+# отсортированные массивы ключей (начала слов названия) по видам подсказок и список подсказок. Запрос
+# к подсказкам это двоичный поиск по ключам в памяти без обращения к базе. Изменения каталога не пересобирают
+# снимок, а дописываются в журнал рядом с ним (см. ChangeLog); журнал сливается в снимок командой rebuild_autocomplete
+
+# Порядок подсказок одного префикса: сначала категории, потом бренды, потом товары
+KIND_CATEGORY = 'category'
+KIND_BRAND = 'brand'
+KIND_PRODUCT = 'product'
+KIND_RANKS = {KIND_CATEGORY: 0, KIND_BRAND: 1, KIND_PRODUCT: 2}
+
+MAGIC = b'DAC2'
+HEADER = struct.Struct(f'=4sII{len(KIND_RANKS)}I')  # Метка, кол-во ключей, кол-во подсказок, кол-во ключей вида
+OFFSET = struct.Struct('=I')
+
+
+def normalize(text):
+    return ' '.join((text or '').lower().replace('ё', 'е').split())
+
+
+# Функция возвращает ключи подсказки: название целиком и с каждого следующего слова,
+# чтобы "Samsung Galaxy S23" находился и по "sam", и по "gal", и по "s2"
+def get_keys(label):
+    words = normalize(label).split(' ')
+    return {' '.join(words[i:]) for i in range(len(words)) if words[i]}
+
+
+def get_url(kind, key):
+    if kind == KIND_CATEGORY:
+        return reverse('category_page', kwargs={'slug': key})
+    if kind == KIND_BRAND:
+        return f"{reverse('search')}?{urlencode({'q': key})}"
+    return reverse('product_detail', kwargs={'slug': key})
+
+
+def get_rank(entry):
+    kind, title, _ = entry
+    return KIND_RANKS[kind], len(title), title
+
+
+# Функция собирает подсказки из базы: [(вид, название, ссылка), ...] (три запроса).
+# keys - {вид: slug категорий и товаров или названия брендов}, тогда собираются только эти подсказки
+def get_entries(keys=None):
+    def select(kind, queryset, field):
+        if keys is None:
+            return queryset
+        return queryset.filter(**{f'{field}__in': keys[kind]}) if keys.get(kind) else queryset.none()
+
+    entries = []
+    for slug, title in select(KIND_CATEGORY, Category.objects.exclude(slug=None), 'slug').values_list('slug', 'title'):
+        entries.append((KIND_CATEGORY, title, get_url(KIND_CATEGORY, slug)))
+    for title in select(KIND_BRAND, Brand.objects.all(), 'title').values_list('title', flat=True).distinct():
+        entries.append((KIND_BRAND, title, get_url(KIND_BRAND, title)))
+    for slug, title in select(KIND_PRODUCT, Product.objects.exclude(slug=None), 'slug').values_list('slug', 'title'):
+        entries.append((KIND_PRODUCT, title, get_url(KIND_PRODUCT, slug)))
+    return entries
+
+
+# Функция записывает снимок: заголовок, смещения ключей, смещения подсказок, данные. Ключи отсортированы
+# по виду подсказки, внутри вида - по байтам, чтобы товары не вытесняли категории и бренды при поиске.
+# Файл пишется во временный и подменяется целиком, читатели видят либо старый, либо новый снимок
+def write_snapshot(path, entries):
+    entries = sorted(set(entries), key=get_rank)
+    keys = sorted(
+        (KIND_RANKS[kind], key.encode(), index) for index, (kind, label, _) in enumerate(entries)
+        for key in get_keys(label)
+    )
+    kind_counts = [0] * len(KIND_RANKS)
+    for rank, _, _ in keys:
+        kind_counts[rank] += 1
+
+    key_records = [key + b'\t' + str(index).encode() for _, key, index in keys]
+    entry_records = [json.dumps(entry, ensure_ascii=False).encode() for entry in entries]
+
+    offsets = []
+    position = 0
+    for record in key_records + entry_records:
+        offsets.append(position)
+        position += len(record)
+    offsets.append(position)
+    key_offsets = offsets[:len(key_records) + 1]
+    entry_offsets = offsets[len(key_records):]
+
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile('wb', dir=directory, delete=False) as file:
+        file.write(HEADER.pack(MAGIC, len(key_records), len(entry_records), *kind_counts))
+        file.write(struct.pack(f'={len(key_offsets)}I', *key_offsets))
+        file.write(struct.pack(f'={len(entry_offsets)}I', *entry_offsets))
+        file.write(b''.join(key_records + entry_records))
+    os.replace(file.name, path)
+
+
+def get_log_path(path):
+    return f'{path}.log'
+
+
+# Функция дописывает строки в журнал изменений одной записью (O_APPEND, строки разных процессов не смешиваются).
+# Если журнал в это время подменило слияние, строки дописываются и в новый журнал: повтор изменения безвреден
+def append_log(log_path, data):
+    while True:
+        file = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(file, data)
+            inode = os.fstat(file).st_ino
+        finally:
+            os.close(file)
+        try:
+            if os.stat(log_path).st_ino == inode:
+                return
+        except FileNotFoundError:
+            pass
+
+
+# Функция записывает в журнал текущее состояние подсказок: {вид: slug или названия} -> строка JSON
+# на каждую ссылку {"url": ..., "entry": [вид, название, ссылка]} или "entry": null, если подсказки больше нет
+def log_changes(keys, path=None):
+    path = path or settings.AUTOCOMPLETE_SNAPSHOT
+    changes = {get_url(kind, key): None for kind, kind_keys in keys.items() for key in kind_keys}
+    for entry in get_entries(keys):
+        changes[entry[2]] = entry
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    append_log(get_log_path(path), b''.join(
+        json.dumps({'url': url, 'entry': entry}, ensure_ascii=False).encode() + b'\n' for url, entry in changes.items()
+    ))
+
+
+# Функция запоминает изменённые подсказки (slug или названия до и после изменения) и после коммита записывает
+# их в журнал одной записью на транзакцию. Состояние подсказок берётся из базы в момент записи, поэтому
+# изменения из откаченной транзакции, попавшие в следующую запись, ничего не портят
+def schedule_changes(kind, *keys):
+    connection = transaction.get_connection()
+    if not hasattr(connection, 'autocomplete_changes'):
+        connection.autocomplete_changes = {}
+    connection.autocomplete_changes.setdefault(kind, set()).update(key for key in keys if key)
+
+    def flush():
+        changes, connection.autocomplete_changes = connection.autocomplete_changes, {}
+        if changes:
+            log_changes(changes)
+
+    transaction.on_commit(flush)
+
+
+# Функция сливает журнал в снимок: снимок строится из базы заново, а в новый журнал переносятся только
+# строки, дописанные во время сборки (они могли не попасть в снимок)
+def build_snapshot(path=None):
+    path = path or settings.AUTOCOMPLETE_SNAPSHOT
+    log_path = get_log_path(path)
+    try:
+        start = os.path.getsize(log_path)
+    except FileNotFoundError:
+        start = None
+    write_snapshot(path, get_entries())
+    if start is None:
+        return
+
+    with open(log_path, 'rb') as old_log:
+        old_log.seek(start)
+        data = old_log.read()
+        data = data[:data.rfind(b'\n') + 1]
+        with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(log_path) or '.', delete=False) as file:
+            file.write(data)
+        os.replace(file.name, log_path)
+        old_log.seek(start + len(data))
+        rest = old_log.read()  # Дописанное в старый журнал, пока он подменялся
+    if rest:
+        append_log(log_path, rest)
+
+
+def has_changes(path=None):
+    try:
+        return os.path.getsize(get_log_path(path or settings.AUTOCOMPLETE_SNAPSHOT)) > 0
+    except FileNotFoundError:
+        return False
+
+
+# Ключи снимка как последовательность для bisect: keys[i] -> байты ключа
+class SnapshotKeys:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self):
+        return self.snapshot.key_count
+
+    def __getitem__(self, index):
+        return self.snapshot.get_key_record(index)[0]
+
+
+class Snapshot:
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.version = get_file_version(os.fstat(file.fileno()))
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.key_count, self.entry_count, *kind_counts = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError(f'{path} не является снимком подсказок')
+
+        # Границы ключей каждого вида подсказок: [(начало, конец), ...] в порядке KIND_RANKS
+        self.sections = []
+        start = 0
+        for count in kind_counts:
+            self.sections.append((start, start + count))
+            start += count
+
+        view = memoryview(self.data)
+        start = HEADER.size
+        end = start + OFFSET.size * (self.key_count + 1)
+        self.key_offsets = view[start:end].cast('I')
+        start, end = end, end + OFFSET.size * (self.entry_count + 1)
+        self.entry_offsets = view[start:end].cast('I')
+        self.data_start = end
+        self.keys = SnapshotKeys(self)
+
+    def get_record(self, offsets, index):
+        start = self.data_start + offsets[index]
+        return self.data[start:self.data_start + offsets[index + 1]]
+
+    def get_key_record(self, index):
+        key, entry = self.get_record(self.key_offsets, index).rsplit(b'\t', 1)
+        return key, int(entry)
+
+    def get_entry(self, index):
+        kind, title, url = json.loads(self.get_record(self.entry_offsets, index))
+        return {'kind': kind, 'title': title, 'url': url}
+
+    # Номера подсказок с ключами на prefix среди ключей [start, end), не больше AUTOCOMPLETE_SCAN_LIMIT ключей
+    def scan(self, prefix, start, end):
+        first = bisect.bisect_left(self.keys, prefix, start, end)
+        found = set()
+        for index in range(first, min(end, first + settings.AUTOCOMPLETE_SCAN_LIMIT)):
+            key, entry = self.get_key_record(index)
+            if not key.startswith(prefix):
+                break
+            found.add(entry)
+        return found
+
+    # Подсказки по началу слова без подсказок со ссылками из skip. Ключи каждого вида просматриваются отдельно,
+    # начиная с категорий. Подсказки в снимке уже упорядочены по важности, поэтому берутся наименьшие номера
+    def complete(self, prefix, limit, skip=()):
+        found = set()
+        for start, end in self.sections:
+            found |= self.scan(prefix, start, end)
+            if len(found) >= limit + len(skip):
+                break
+        entries = []
+        for index in sorted(found):
+            entry = self.get_entry(index)
+            if entry['url'] not in skip:
+                entries.append(entry)
+                if len(entries) == limit:
+                    break
+        return entries
+
+
+# Журнал изменений подсказок поверх снимка. Каждый процесс дочитывает журнал с места, где остановился,
+# и держит в памяти последнее состояние каждой изменённой ссылки и отсортированные по видам ключи живых подсказок
+class ChangeLog:
+    def __init__(self, path):
+        self.path = path
+        self.reset()
+
+    def reset(self, version=None):
+        self.version = version
+        self.offset = 0
+        self.entries = {}
+        self.keys = []
+
+    def refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None
+        if stat is None:
+            self.reset()
+            return
+        if (stat.st_ino, stat.st_size) == (self.version, self.offset):
+            return
+
+        try:
+            file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with file:
+            stat = os.fstat(file.fileno())
+            if stat.st_ino != self.version or stat.st_size < self.offset:  # Журнал подменило слияние
+                self.reset(stat.st_ino)
+            file.seek(self.offset)
+            data = file.read(stat.st_size - self.offset)
+        data = data[:data.rfind(b'\n') + 1]  # Недописанная строка дочитывается в следующий раз
+        self.offset += len(data)
+        for line in data.splitlines():
+            change = json.loads(line)
+            self.entries[change['url']] = tuple(change['entry']) if change['entry'] else None
+        self.keys = sorted(
+            (KIND_RANKS[entry[0]], key.encode(), entry)
+            for entry in self.entries.values() if entry for key in get_keys(entry[1])
+        )
+
+    # Подсказки по началу слова, ключи каждого вида просматриваются отдельно, как в снимке
+    def complete(self, prefix):
+        found = set()
+        for rank in KIND_RANKS.values():
+            first = bisect.bisect_left(self.keys, (rank, prefix))
+            for key_rank, key, entry in self.keys[first:first + settings.AUTOCOMPLETE_SCAN_LIMIT]:
+                if key_rank != rank or not key.startswith(prefix):
+                    break
+                found.add(entry)
+        return found
+
+
+def get_file_version(stat):
+    return stat.st_ino, stat.st_mtime_ns
+
+
+_snapshot = None
+
+
+# Функция возвращает открытый снимок, заново открывая его если файл был пересобран.
+# Если снимка ещё нет или он старого формата, он строится из базы (только при первом запросе)
+def get_snapshot():
+    global _snapshot
+    path = settings.AUTOCOMPLETE_SNAPSHOT
+    try:
+        version = get_file_version(os.stat(path))
+    except FileNotFoundError:
+        build_snapshot(path)
+        version = get_file_version(os.stat(path))
+    if _snapshot is None or _snapshot.path != path or _snapshot.version != version:
+        try:
+            _snapshot = Snapshot(path)
+        except (ValueError, struct.error):
+            build_snapshot(path)
+            _snapshot = Snapshot(path)
+        _snapshot.path = path
+    return _snapshot
+
+
+_change_log = None
+
+
+def get_change_log():
+    global _change_log
+    path = get_log_path(settings.AUTOCOMPLETE_SNAPSHOT)
+    if _change_log is None or _change_log.path != path:
+        _change_log = ChangeLog(path)
+    _change_log.refresh()
+    return _change_log
+
+
+# Подсказки снимка, кроме изменённых после его сборки, вместе с подсказками из журнала
+def get_suggestions(prefix, limit=None):
+    limit = limit or settings.AUTOCOMPLETE_LIMIT
+    prefix = normalize(prefix).encode()
+    if not prefix:
+        return []
+    snapshot = get_snapshot()
+    change_log = get_change_log()
+    entries = [
+        {'kind': kind, 'title': title, 'url': url}
+        for kind, title, url in sorted(change_log.complete(prefix), key=get_rank)[:limit]
+    ]
+    entries += snapshot.complete(prefix, limit, skip=change_log.entries)
+    return sorted(entries, key=lambda entry: get_rank((entry['kind'], entry['title'], entry['url'])))[:limit]
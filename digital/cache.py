@@ -0,0 +1,33 @@
+import time
+
+from django.core.cache import cache
+
+
+# Версии кэша. При изменении данных версия увеличивается и все старые ключи перестают читаться.
+# Начальная версия - время создания, чтобы после вытеснения ключа версии не прочитать старые данные
+def get_cache_version(name):
+    key = f'version:{name}'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(name):
+    key = f'version:{name}'
+    try:
+        return cache.incr(key)
+    except ValueError:  # Версии ещё нет в кэше
+        return get_cache_version(name)
+
+
+# Сброс версий многих ключей одним запросом к кэшу: версия удаляется и создаётся заново от текущего времени,
+# то есть больше любой старой версии
+def bump_cache_versions(names):
+    cache.delete_many([f'version:{name}' for name in names])
+
+
+# Функция возвращает ключ кэша с текущей версией: category_tree:v17:...
+def versioned_key(name, *parts):
+    return ':'.join([name, f'v{get_cache_version(name)}', *map(str, parts)])
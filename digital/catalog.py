@@ -0,0 +1,132 @@
+import hashlib
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.urls import reverse
+
+from .cache import versioned_key
+from .models import Category, Product
+from .utils import get_card_products
+
+
+# Категория из кэша. Повторяет методы Category которые используют шаблоны
+class CategoryNode:
+    def __init__(self, category):
+        self.pk = category.pk
+        self.title = category.title
+        self.slug = category.slug
+        self.parent_id = category.parent_id
+        self.url = reverse('category_page', kwargs={'slug': category.slug}) if category.slug else '#'
+        self.image_url = category.get_image_category()
+        self.subcategories = []
+
+    def get_absolute_url(self):
+        return self.url
+
+    def get_image_category(self):
+        return self.image_url
+
+    def __str__(self):
+        return self.title
+
+
+# Дерево категорий: корневые категории, поиск по slug и по id
+class CategoryTree:
+    def __init__(self, categories):
+        self.by_id = {category.pk: CategoryNode(category) for category in categories}
+        self.by_slug = {node.slug: node for node in self.by_id.values() if node.slug}
+        self.roots = []
+        for node in self.by_id.values():
+            parent = self.by_id.get(node.parent_id)
+            if parent:
+                parent.subcategories.append(node)
+            else:
+                self.roots.append(node)
+
+    # Цепочка категорий от корня до нужной, для хлебных крошек
+    def get_breadcrumbs(self, category_id):
+        breadcrumbs = []
+        node = self.by_id.get(category_id)
+        while node and node not in breadcrumbs:
+            breadcrumbs.insert(0, node)
+            node = self.by_id.get(node.parent_id)
+        return breadcrumbs
+
+
+# Функция возвращает дерево категорий из кэша. Кэш сбрасывается сигналами при изменении категорий
+def get_category_tree():
+    key = versioned_key('category_tree')
+    tree = cache.get(key)
+    if tree is None:
+        tree = CategoryTree(Category.objects.order_by('pk'))
+        cache.set(key, tree, settings.CATALOG_CACHE_TIMEOUT)
+    return tree
+
+
+# Функция возвращает id новинок: последние NEW_ARRIVALS_PER_CATEGORY товаров каждой категории
+# (оконная функция ROW_NUMBER), всего не больше NEW_ARRIVALS_LIMIT. Список хранится в кэше
+def get_new_arrival_ids():
+    key = versioned_key('new_arrivals')
+    ids = cache.get(key)
+    if ids is None:
+        products = Product.objects.annotate(category_rank=Window(
+            RowNumber(), partition_by=F('category_id'), order_by=[F('created_at').desc(), F('pk').desc()]
+        ))
+        ids = list(products.filter(category_rank__lte=settings.NEW_ARRIVALS_PER_CATEGORY)
+                   .order_by('-created_at', '-pk').values_list('pk', flat=True)[:settings.NEW_ARRIVALS_LIMIT])
+        cache.set(key, ids, settings.CATALOG_CACHE_TIMEOUT)
+    return ids
+
+
+# Функция возвращает новинки для главной страницы одним запросом
+def get_new_arrivals():
+    ids = get_new_arrival_ids()
+    products = {product.pk: product for product in get_card_products(Product.objects.filter(pk__in=ids))}
+    return [products[pk] for pk in ids if pk in products]
+
+
+# Вариант модели товара (цвет) для переключателя цветов на странице товара
+Variant = namedtuple('Variant', ['color_cod', 'color_name', 'slug'])
+
+
+# Имя версии кэша вариантов модели (название модели может содержать пробелы, поэтому берётся хэш)
+def get_variants_cache_name(model_product):
+    return 'variants:' + hashlib.md5(model_product.encode()).hexdigest()
+
+
+# Функция загружает варианты модели одним запросом по индексу (model_product, color_cod) и кладёт в кэш
+# рядом со списком вариантов словарь {цвет: slug} для перехода на товар нужного цвета
+def load_variants(model_product):
+    rows = (Product.objects.filter(model_product=model_product).order_by('color_cod', 'pk')
+            .values_list('color_cod', 'color_name', 'slug'))
+    variants = [Variant(*row) for row in rows]
+    slugs = {}
+    for variant in variants:
+        slugs.setdefault(variant.color_cod, variant.slug)
+    name = get_variants_cache_name(model_product)
+    cache.set_many({versioned_key(name): variants, versioned_key(name, 'colors'): slugs},
+                   settings.CATALOG_CACHE_TIMEOUT)
+    return variants, slugs
+
+
+# Функция возвращает варианты модели [Variant, ...] из кэша. Кэш сбрасывается сигналами при изменении товаров модели
+def get_variants(model_product):
+    if not model_product:
+        return []
+    variants = cache.get(versioned_key(get_variants_cache_name(model_product)))
+    if variants is None:
+        variants, _ = load_variants(model_product)
+    return variants
+
+
+# Функция возвращает slug товара модели нужного цвета (по словарю цветов из кэша)
+def get_variant_slug(model_product, color_cod):
+    if not model_product:
+        return None
+    slugs = cache.get(versioned_key(get_variants_cache_name(model_product), 'colors'))
+    if slugs is None:
+        _, slugs = load_variants(model_product)
+    return slugs.get(color_cod)
@@ -0,0 +1,6 @@
+from .middleware import get_buyer
+
+
+# Покупатель и его заказ в шаблонах: {{ buyer.order.get_cart_total_quantity }}
+def buyer(request):
+    return {'buyer': get_buyer(request)}
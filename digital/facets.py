@@ -0,0 +1,188 @@
+from collections import namedtuple
+from functools import cached_property
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Floor
+
+from .cache import bump_cache_version, versioned_key
+from .models import Category, CategoryFacet, Product
+
+# Вариант фильтра для шаблона: значение и кол-во товаров с ним
+FacetOption = namedtuple('FacetOption', ['value', 'count'])
+
+FACETS = [CategoryFacet.BRAND, CategoryFacet.COLOR, CategoryFacet.PRICE, CategoryFacet.DISCOUNT]
+
+
+# Функция возвращает начало ценового диапазона в который попадает цена
+def get_price_bucket(price):
+    step = settings.FACET_PRICE_STEP
+    return int(price // step * step)
+
+
+# Функция возвращает значения фильтров товара в виде {фильтр: значение}
+def get_product_facets(product):
+    return {
+        CategoryFacet.BRAND: product.brand.title if product.brand_id else '',
+        CategoryFacet.COLOR: product.color_name or '',
+        CategoryFacet.PRICE: str(get_price_bucket(product.price)),
+        CategoryFacet.DISCOUNT: product.discount or '',
+    }
+
+
+# Функция прибавляет (delta=1) или убавляет (delta=-1) товар в индексе фильтров категории
+def update_category_facets(category_id, facets, delta):
+    with transaction.atomic():
+        for facet, value in facets.items():
+            if delta > 0:
+                CategoryFacet.objects.get_or_create(category_id=category_id, facet=facet, value=value)
+            CategoryFacet.objects.filter(category_id=category_id, facet=facet, value=value).update(
+                count=F('count') + delta
+            )
+        CategoryFacet.objects.filter(category_id=category_id, count__lte=0).delete()
+    bump_cache_version(f'facets:{category_id}')  # Сбрасываем закэшированные фильтры категории
+
+
+# Функция полностью пересобирает индекс фильтров категорий (после массовых изменений через update())
+def rebuild_category_facets(categories=None):
+    products = Product.objects.select_related('brand')
+    facets = CategoryFacet.objects.all()
+    if categories is not None:
+        products = products.filter(category__in=categories)
+        facets = facets.filter(category__in=categories)
+
+    counts = {}
+    for product in products.iterator():
+        for facet, value in get_product_facets(product).items():
+            key = (product.category_id, facet, value)
+            counts[key] = counts.get(key, 0) + 1
+
+    with transaction.atomic():
+        facets.delete()
+        CategoryFacet.objects.bulk_create([
+            CategoryFacet(category_id=category_id, facet=facet, value=value, count=count)
+            for (category_id, facet, value), count in counts.items()
+        ])
+
+    category_ids = Category.objects.values_list('pk', flat=True)
+    if categories is not None:
+        category_ids = category_ids.filter(pk__in=categories)
+    for category_id in category_ids:
+        bump_cache_version(f'facets:{category_id}')
+
+
+# Функция сортирует варианты фильтра: цены по числу, остальное по алфавиту
+def sort_options(facet, options):
+    if facet == CategoryFacet.PRICE:
+        return sorted(options, key=lambda option: int(option.value))
+    return sorted(options, key=lambda option: option.value)
+
+
+# Функция считает кол-во товаров для каждого варианта фильтра с учётом выбранных фильтров.
+# Один групповой запрос по комбинациям значений (цена - по ценовому диапазону), для каждого фильтра
+# отдельный COUNT(...) FILTER (WHERE все остальные выбранные фильтры)
+def count_filtered_facets(category, product_filter):
+    step = settings.FACET_PRICE_STEP
+    rows = Product.objects.filter(category_id=category.pk).values(
+        'brand__title', 'color_name', 'discount', price_bucket=Floor(F('price') / step)
+    ).annotate(**{
+        f'{facet}_count': Count('pk', filter=product_filter.get_q(exclude=facet)) for facet in FACETS
+    })
+
+    counts = {facet: {} for facet in FACETS}
+    for row in rows:
+        values = {
+            CategoryFacet.BRAND: row['brand__title'] or '',
+            CategoryFacet.COLOR: row['color_name'] or '',
+            CategoryFacet.PRICE: str(int(row['price_bucket']) * step),
+            CategoryFacet.DISCOUNT: row['discount'] or '',
+        }
+        for facet, value in values.items():
+            if row[f'{facet}_count']:
+                counts[facet][value] = counts[facet].get(value, 0) + row[f'{facet}_count']
+
+    return counts
+
+
+# Функция возвращает индекс фильтров категории {фильтр: [FacetOption, ...]} одним запросом
+def get_facet_index(category):
+    options = {facet: [] for facet in FACETS}
+    for item in CategoryFacet.objects.filter(category_id=category.pk):
+        options[item.facet].append(FacetOption(item.value, item.count))
+    return options
+
+
+# Функция пересчитывает кол-во товаров в вариантах индекса с учётом выбранных фильтров
+def filter_facet_options(category, product_filter, options):
+    counts = count_filtered_facets(category, product_filter)
+    filtered = {}
+    for facet in FACETS:
+        selected = product_filter.get_selected(facet)
+        filtered[facet] = [
+            FacetOption(option.value, counts[facet].get(option.value, 0))
+            for option in options[facet]
+            if counts[facet].get(option.value) or option.value in selected
+        ]
+    return filtered
+
+
+# Функция возвращает фильтры категории {фильтр: [FacetOption, ...]}.
+# Без выбранных фильтров это один запрос к индексу, иначе кол-во пересчитывается одним групповым запросом
+def get_category_facets(category, product_filter=None):
+    options = get_facet_index(category)
+    if product_filter is not None and product_filter.is_active:
+        options = filter_facet_options(category, product_filter, options)
+    return {facet: sort_options(facet, facet_options) for facet, facet_options in options.items()}
+
+
+# Функция возвращает фильтры категории из кэша. Индекс и пересчитанные кол-ва хранятся под версией фильтров
+# категории, пересчёт - под ключом из известных выбранных значений (см. ProductFilter.get_cache_key)
+def get_cached_category_facets(category, product_filter=None):
+    name = f'facets:{category.pk}'
+    options = cache.get(versioned_key(name, 'index'))
+    if options is None:
+        options = get_facet_index(category)
+        cache.set(versioned_key(name, 'index'), options, settings.CATALOG_CACHE_TIMEOUT)
+
+    if product_filter is not None and product_filter.is_active:
+        key = product_filter.get_cache_key(options)
+        if key is None:  # Цена не по границам диапазонов, такой пересчёт не кэшируется
+            options = filter_facet_options(category, product_filter, options)
+        else:
+            key = versioned_key(name, key)
+            filtered = cache.get(key)
+            if filtered is None:
+                filtered = filter_facet_options(category, product_filter, options)
+                cache.set(key, filtered, settings.CATALOG_CACHE_TIMEOUT)
+            options = filtered
+
+    return {facet: sort_options(facet, facet_options) for facet, facet_options in options.items()}
+
+
+# Фильтры категории для шаблона. Берутся из кэша при первом обращении
+class LazyCategoryFacets:
+    def __init__(self, category, product_filter=None):
+        self.category = category
+        self.product_filter = product_filter
+
+    @cached_property
+    def facets(self):
+        return get_cached_category_facets(self.category, self.product_filter)
+
+    @property
+    def brands(self):
+        return self.facets[CategoryFacet.BRAND]
+
+    @property
+    def colors(self):
+        return self.facets[CategoryFacet.COLOR]
+
+    @property
+    def prices(self):
+        return self.facets[CategoryFacet.PRICE]
+
+    @property
+    def discounts(self):
+        return self.facets[CategoryFacet.DISCOUNT]
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .cache import bump_cache_version, versioned_key
+from .models import FavoriteProduct
+
+# Избранное пользователя. Множество id избранных товаров кэшируется отдельно для каждого пользователя,
+# при изменении избранного (переключение, админка) версия кэша пользователя увеличивается.
+# Версия хранится в общем кэше (CACHES), поэтому новое состояние сразу видят все воркеры
+
+
+def get_favorites_cache_name(user_id):
+    return f'favorites:{user_id}'
+
+
+# Функция сбрасывает кэш избранного после коммита, чтобы не закэшировать незакоммиченные данные
+def reset_favorites(user_id):
+    transaction.on_commit(lambda: bump_cache_version(get_favorites_cache_name(user_id)))
+
+
+# Функция возвращает множество id избранных товаров пользователя (из кэша, без запроса к базе)
+def get_favorite_ids(user):
+    if not user.is_authenticated:
+        return set()
+    key = versioned_key(get_favorites_cache_name(user.pk))
+    ids = cache.get(key)
+    if ids is None:
+        ids = set(FavoriteProduct.objects.filter(user=user).values_list('product_id', flat=True))
+        cache.set(key, ids, settings.FAVORITES_CACHE_TIMEOUT)
+    return ids
+
+
+# Функция добавляет товар в избранное или убирает из него. Вернёт True если товар теперь в избранном.
+# Сначала пробуем удалить, если удалять нечего - вставляем. Повторная вставка (двойной клик)
+# упирается в unique_user_favorite и пропускается
+def toggle_favorite(user, product_id):
+    with transaction.atomic():
+        deleted, _ = FavoriteProduct.objects.filter(user=user, product_id=product_id).delete()
+        if not deleted:
+            FavoriteProduct.objects.bulk_create(
+                [FavoriteProduct(user=user, product_id=product_id)], ignore_conflicts=True
+            )
+            reset_favorites(user.pk)  # bulk_create не отправляет post_save
+    return not deleted
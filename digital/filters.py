@@ -0,0 +1,92 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Brand, CategoryFacet
+
+
+# Функция переводит значение из строки запроса в число, неправильные значения пропускаются
+def parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# Фильтр товаров категории по строке запроса:
+# ?brand=Apple&brand=Samsung&color=Белый&price_min=1000000&price_max=5000000&discount=-10%
+# Все условия собираются в один запрос, который ложится на составные индексы (category, ...)
+class ProductFilter:
+    def __init__(self, params):
+        self.brands = {value for value in params.getlist('brand') if value}
+        self.colors = {value for value in params.getlist('color') if value}
+        self.discounts = {value for value in params.getlist('discount') if value}
+        self.price_min = parse_int(params.get('price_min'))
+        self.price_max = parse_int(params.get('price_max'))
+        self.price_below = None
+
+        # Старый вариант ссылки ?price=<начало диапазона> из фильтра цен
+        price_bucket = parse_int(params.get('price'))
+        if price_bucket is not None:
+            self.price_min = price_bucket
+            self.price_below = price_bucket + settings.FACET_PRICE_STEP
+
+    @property
+    def is_active(self):
+        return bool(self.brands or self.colors or self.discounts or self.has_price)
+
+    @property
+    def has_price(self):
+        return any(value is not None for value in (self.price_min, self.price_max, self.price_below))
+
+    # Выбранные значения фильтра (у цены выбирается диапазон, а не значения)
+    def get_selected(self, facet):
+        return {
+            CategoryFacet.BRAND: self.brands,
+            CategoryFacet.COLOR: self.colors,
+            CategoryFacet.DISCOUNT: self.discounts,
+        }.get(facet, set())
+
+    # Ключ кэша пересчитанных фильтров по индексу категории {фильтр: [FacetOption, ...]}.
+    # В ключ попадают только значения из индекса, по порядку: неизвестные значения ничего не выбирают,
+    # поэтому любое их кол-во записывается одним '*'. Цена без границ ценовых диапазонов даёт None (не кэшировать)
+    def get_cache_key(self, options):
+        selected = {}
+        for facet in (CategoryFacet.BRAND, CategoryFacet.COLOR, CategoryFacet.DISCOUNT):
+            values = self.get_selected(facet)
+            known = sorted(values & {option.value for option in options[facet]})
+            selected[facet] = known + ['*'] if len(known) < len(values) else known
+
+        step = settings.FACET_PRICE_STEP
+        bounds = set()
+        for option in options[CategoryFacet.PRICE]:
+            bounds.update((int(option.value), int(option.value) + step))
+        prices = [self.price_min, self.price_max, self.price_below]
+        if any(price is not None and price not in bounds for price in prices):
+            return None
+        selected[CategoryFacet.PRICE] = prices
+
+        return hashlib.md5(json.dumps(selected, sort_keys=True).encode()).hexdigest()
+
+    # Условие выбранных фильтров. exclude - фильтр без своего условия (для подсчёта кол-ва его вариантов)
+    def get_q(self, exclude=None):
+        q = Q()
+        if self.brands and exclude != CategoryFacet.BRAND:
+            q &= Q(brand__in=Brand.objects.filter(title__in=self.brands))
+        if self.colors and exclude != CategoryFacet.COLOR:
+            q &= Q(color_name__in=self.colors)
+        if exclude != CategoryFacet.PRICE:
+            if self.price_min is not None:
+                q &= Q(price__gte=self.price_min)
+            if self.price_max is not None:
+                q &= Q(price__lte=self.price_max)
+            if self.price_below is not None:
+                q &= Q(price__lt=self.price_below)
+        if self.discounts and exclude != CategoryFacet.DISCOUNT:
+            q &= Q(discount__in=self.discounts)
+        return q
+
+    def filter(self, queryset):
+        return queryset.filter(self.get_q())
@@ -0,0 +1,100 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps, features
+
+from .cache import bump_cache_version
+
+logger = logging.getLogger(__name__)
+
+# Размеры картинок: (название, наибольшая сторона в px). Уменьшенные копии лежат рядом с оригиналом:
+# products/phone.png -> products/phone.card.webp
+SIZES = {
+    'thumb': 150,
+    'card': 400,
+    'detail': 1000,
+}
+
+# WebP если Pillow собран с его поддержкой, иначе JPEG
+FORMAT, EXTENSION = ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+
+
+def get_variant_name(name, size):
+    root, _ = os.path.splitext(name)
+    return f'{root}.{size}.{EXTENSION}'
+
+
+# Функция создаёт уменьшенные копии картинки. Возвращает True если копии созданы.
+# Картинки которые Pillow не открывает (SVG, битые файлы) пропускаются, для них остаётся оригинал
+def generate_variants(name, storage, force=False):
+    if not name:
+        return False
+    if not force and storage.exists(get_variant_name(name, 'detail')):
+        return False
+    try:
+        with storage.open(name, 'rb') as file:
+            original = ImageOps.exif_transpose(Image.open(file))
+            original.load()
+    except (OSError, Image.DecompressionBombError) as error:
+        logger.warning('Не удалось открыть картинку %s: %s', name, error)
+        return False
+
+    if FORMAT == 'JPEG' or original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGB' if FORMAT == 'JPEG' else 'RGBA')
+
+    # Сохраняем от меньшей к большей: detail пишется последним, его наличие означает что все копии на месте
+    for size, side in sorted(SIZES.items(), key=lambda item: item[1]):
+        image = original.copy()
+        image.thumbnail((side, side), Image.LANCZOS)
+        buffer = BytesIO()
+        image.save(buffer, FORMAT, quality=settings.IMAGE_QUALITY, method=4 if FORMAT == 'WEBP' else 0)
+        variant_name = get_variant_name(name, size)
+        if storage.exists(variant_name):
+            storage.delete(variant_name)
+        storage.save(variant_name, ContentFile(buffer.getvalue()))
+    return True
+
+
+# Функция возвращает ссылки на копии картинки {размер: url}, пустой словарь если копий ещё нет
+def get_variant_urls(field_file):
+    if not field_file or not field_file.storage.exists(get_variant_name(field_file.name, 'detail')):
+        return {}
+    return {size: field_file.storage.url(get_variant_name(field_file.name, size)) for size in SIZES}
+
+
+# Значение для srcset: "url 150w, url 400w, url 1000w"
+def get_srcset(field_file):
+    urls = get_variant_urls(field_file)
+    return ', '.join(f'{urls[size]} {side}w' for size, side in SIZES.items() if size in urls)
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS, thread_name_prefix='images')
+    return _executor
+
+
+# Функция ставит создание копий картинки в пул потоков после сохранения в базе.
+# Когда копии готовы, сбрасывается кэш (cache_name) где закэшированы ссылки на картинку
+def schedule_variants(field_file, cache_name):
+    name, storage = field_file.name, field_file.storage
+
+    def task():
+        if generate_variants(name, storage):
+            bump_cache_version(cache_name)
+
+    if not name:
+        return
+    if settings.IMAGE_VARIANTS_ASYNC:
+        transaction.on_commit(lambda: get_executor().submit(task))
+    else:
+        task()
@@ -0,0 +1,84 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.http import QueryDict
+
+from digital.facets import count_filtered_facets
+from digital.filters import ProductFilter
+from digital.models import Category, Brand, Product
+
+COLORS = ['Чёрный', 'Белый', 'Синий', 'Красный', 'Зелёный', 'Серый']
+DISCOUNTS = ['', '-5%', '-10%', '-15%', '-20%']
+
+QUERIES = [
+    'brand=Brand 1',
+    'brand=Brand 1&brand=Brand 2&color=Белый',
+    'price_min=1000000&price_max=3000000',
+    'brand=Brand 3&price_min=500000&price_max=9000000&discount=-10%',
+    'color=Синий&color=Красный&discount=-5%&discount=-20%',
+]
+
+
+# Замер фильтров категории на синтетическом каталоге.
+# Каталог создаётся внутри транзакции и откатывается после замера, база не меняется
+class Command(BaseCommand):
+    help = 'Замер скорости фильтров категории на синтетическом каталоге'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000, help='Кол-во товаров в каталоге')
+        parser.add_argument('--categories', type=int, default=20, help='Кол-во категорий')
+        parser.add_argument('--repeat', type=int, default=20, help='Кол-во повторов каждого запроса')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            category = self.create_catalog(options['products'], options['categories'])
+            self.run_queries(category, options['repeat'])
+            transaction.set_rollback(True)
+
+    def create_catalog(self, total, categories_count):
+        self.stdout.write(f'Создаём {total} товаров в {categories_count} категориях...')
+        categories = Category.objects.bulk_create([
+            Category(title=f'Bench {i}', slug=f'bench-category-{i}') for i in range(categories_count)
+        ])
+        brands = Brand.objects.bulk_create([Brand(title=f'Brand {i}') for i in range(30)])
+
+        random.seed(1)
+        Product.objects.bulk_create((
+            Product(
+                title=f'Bench product {i}', price=random.randint(100, 20_000) * 1000, quantity=10,
+                category=categories[i % categories_count], slug=f'bench-product-{i}', memory='128',
+                brand=random.choice(brands), color_name=random.choice(COLORS),
+                discount=random.choice(DISCOUNTS)
+            )
+            for i in range(total)
+        ), batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return categories[0]
+
+    def run_queries(self, category, repeat):
+        for query in QUERIES:
+            product_filter = ProductFilter(QueryDict(query))
+            products = product_filter.filter(Product.objects.filter(category=category))
+            products = products.order_by('-created_at', '-pk')[:20]
+
+            started = time.perf_counter()
+            for _ in range(repeat):
+                found = list(products.all())
+            elapsed = (time.perf_counter() - started) / repeat * 1000
+
+            sql, params = products.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                plan = '; '.join(row[-1] for row in cursor.fetchall())
+
+            # Пересчёт кол-ва товаров в вариантах фильтров (блок фильтров без кэша)
+            started = time.perf_counter()
+            for _ in range(repeat):
+                count_filtered_facets(category, product_filter)
+            facets_elapsed = (time.perf_counter() - started) / repeat * 1000
+
+            self.stdout.write(f'{query}\n    {elapsed:.2f} мс, товаров на странице: {len(found)}\n    {plan}\n'
+                              f'    кол-во в фильтрах: {facets_elapsed:.2f} мс')
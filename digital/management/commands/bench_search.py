@@ -0,0 +1,78 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from digital.models import Category, Brand, Product, ProductDescription
+from digital.search import has_fts, rebuild_index, search_product_ids
+
+KINDS = ['Смартфон', 'Ноутбук', 'Телевизор', 'Наушники', 'Планшет', 'Смарт-часы']
+BRANDS = ['Samsung', 'Apple', 'Xiaomi', 'Huawei', 'Lenovo', 'LG', 'Sony', 'Honor']
+COLORS = ['чёрный', 'белый', 'синий', 'красный', 'зелёный', 'серый']
+
+QUERIES = [
+    'смартфон',
+    'samsung',
+    'смартфоны samsung чёрные',
+    'ноут',
+    'x12',
+    'телевизор lg белый',
+    'наушники apple x1',
+    'холодильник',
+]
+
+# Цель: поиск страницы результатов быстрее 20 мс на каталоге из 100 000 товаров
+TARGET_MS = 20
+
+
+# Замер поиска товаров на синтетическом каталоге.
+# Каталог и поисковый индекс создаются внутри транзакции и откатываются после замера, база не меняется
+class Command(BaseCommand):
+    help = 'Замер скорости поиска товаров на синтетическом каталоге'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000, help='Кол-во товаров в каталоге')
+        parser.add_argument('--repeat', type=int, default=20, help='Кол-во повторов каждого запроса')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.create_catalog(options['products'])
+            started = time.perf_counter()
+            rebuild_index()
+            backend = 'SQLite FTS5' if has_fts() else 'таблица SearchTerm'
+            self.stdout.write(f'Индекс ({backend}) построен за {time.perf_counter() - started:.1f} с')
+            self.run_queries(options['repeat'])
+            transaction.set_rollback(True)
+
+    def create_catalog(self, total):
+        self.stdout.write(f'Создаём {total} товаров...')
+        category = Category.objects.create(title='Bench search', slug='bench-search')
+        brands = {title: brand for title, brand in zip(BRANDS, Brand.objects.bulk_create([
+            Brand(title=title, category=category) for title in BRANDS
+        ]))}
+
+        random.seed(1)
+        products = []
+        for i in range(total):
+            brand = random.choice(BRANDS)
+            model = f'X{random.randint(1, 500)}'
+            products.append(Product(
+                title=f'{random.choice(KINDS)} {brand} {model} {random.choice(COLORS)}', price=1000, quantity=10,
+                category=category, slug=f'bench-search-{i}', memory='128', brand=brands[brand], model_product=model
+            ))
+        products = Product.objects.bulk_create(products, batch_size=5000)
+        ProductDescription.objects.bulk_create((
+            ProductDescription(product=product, parameter='Экран', parameter_info=f'{random.randint(5, 65)} дюймов')
+            for product in products
+        ), batch_size=5000)
+
+    def run_queries(self, repeat):
+        for query in QUERIES:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                ids, total = search_product_ids(query)
+            elapsed = (time.perf_counter() - started) / repeat * 1000
+
+            style = self.style.SUCCESS if elapsed < TARGET_MS else self.style.WARNING
+            self.stdout.write(style(f'{query}: {elapsed:.2f} мс, найдено {total}, на странице {len(ids)}'))
@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from digital.cache import bump_cache_version
+from digital.images import generate_variants
+from digital.models import Category, Gallery
+
+
+# Команда создаёт уменьшенные копии уже загруженных картинок товаров и категорий
+class Command(BaseCommand):
+    help = 'Создать уменьшенные копии картинок товаров и категорий'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.IMAGE_WORKERS, help='Кол-во потоков')
+        parser.add_argument('--force', action='store_true', help='Пересоздать уже созданные копии')
+
+    def handle(self, *args, **options):
+        images = [(item.image, f'product:{item.product_id}') for item in Gallery.objects.exclude(image='')]
+        images += [(item.image, 'category_tree') for item in Category.objects.exclude(image='').exclude(image=None)]
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            results = list(executor.map(
+                lambda image: generate_variants(image[0].name, image[0].storage, options['force']), images
+            ))
+
+        for (image, cache_name), created in zip(images, results):
+            if created:
+                bump_cache_version(cache_name)
+        self.stdout.write(self.style.SUCCESS(f'Создано копий: {sum(results)} из {len(images)} картинок'))
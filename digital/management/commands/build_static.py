@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from digital.assets import build_css_bundle
+
+
+# Команда собирает статику для продакшена: бандл CSS, шрифты WOFF2, collectstatic с хэшами и сжатием.
+# Запускается с переменной окружения STATIC_BUILD=True (см. README)
+class Command(BaseCommand):
+    help = 'Собрать статику: бандл CSS, шрифты WOFF2, файлы с хэшем и сжатые копии'
+
+    def handle(self, *args, **options):
+        if not settings.STATIC_BUILD:
+            raise CommandError('Включите STATIC_BUILD=True, иначе шаблоны не будут ссылаться на собранную статику')
+
+        path = build_css_bundle()
+        self.stdout.write(f'Бандл CSS: {path}')
+        call_command('collectstatic', interactive=False, verbosity=options['verbosity'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS('Статика собрана'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from digital.models import Category, Product
+from digital.pricing import change_prices
+
+
+# Команда меняет цены товаров на процент одним UPDATE: все товары, товары категории и/или бренда
+class Command(BaseCommand):
+    help = 'Изменить цены товаров на процент (-10 - подешевле на 10%)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('percent', type=float, help='На сколько процентов изменить цену')
+        parser.add_argument('--category', help='slug категории')
+        parser.add_argument('--brand', help='Название бренда')
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+        if options['category']:
+            category = Category.objects.filter(slug=options['category']).first()
+            if category is None:
+                raise CommandError(f'Категория {options["category"]} не найдена')
+            products = products.filter(category=category)
+        if options['brand']:
+            products = products.filter(brand__title=options['brand'])
+
+        count = change_prices(products, options['percent'])
+        self.stdout.write(f'Изменено цен: {count}')
@@ -0,0 +1,97 @@
+import re
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from digital.models import Category, Product, FavoriteProduct
+
+# Полный проход по таблице в плане SQLite: "SCAN digital_product" (без USING INDEX)
+FULL_SCAN_RE = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+# Таблицы которые читаются целиком намеренно: результат кэшируется (дерево категорий) или таблица маленькая
+ALLOWED_SCANS = {'digital_category', 'digital_city'}
+
+
+# Команда открывает страницы магазина, собирает их SQL запросы и прогоняет через EXPLAIN QUERY PLAN.
+# Запросы с полным проходом по таблице выводятся. Кэш отключается, чтобы попали и закэшированные запросы.
+# Всё выполняется в транзакции которая откатывается, база не меняется
+class Command(BaseCommand):
+    help = 'Найти SQL запросы страниц с полным проходом по таблице (EXPLAIN QUERY PLAN, только SQLite)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail', action='store_true', help='Завершиться с ошибкой если есть полные проходы')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN поддерживается только для SQLite')
+        product = Product.objects.exclude(slug=None).exclude(model_product=None).first()
+        if product is None:
+            raise CommandError('Нужен хотя бы один товар с моделью')
+
+        dummy_cache = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        with override_settings(CACHES=dummy_cache, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            with transaction.atomic():
+                scans = self.explain_pages(product)
+                transaction.set_rollback(True)
+
+        self.stdout.write(f'Полных проходов по таблицам: {scans}')
+        if scans and options['fail']:
+            raise CommandError('Есть запросы с полным проходом по таблице')
+
+    # Страницы для проверки: (название, url). Страницы пользователя открываются от временного пользователя.
+    # Подсказок поиска нет: они читаются из файла снимка, а не из базы
+    def get_pages(self, product):
+        category = Category.objects.get(pk=product.category_id)
+        word = product.title.split()[0]
+        return [
+            ('Главная', reverse('index')),
+            ('Категория', reverse('category_page', args=[category.slug])),
+            ('Категория, по цене', reverse('category_page', args=[category.slug]) + '?sort=price'),
+            ('Товар', product.get_absolute_url()),
+            ('Другой цвет', reverse('product_color', args=[product.model_product, product.color_cod or '-'])),
+            ('Поиск', reverse('search') + f'?q={word}'),
+            ('В корзину', reverse('to_cart', args=[product.pk, 'add'])),
+            ('Избранное', reverse('my_favorite')),
+            ('Корзина', reverse('my_cart')),
+            ('Оформление заказа', reverse('checkout')),
+        ]
+
+    def explain_pages(self, product):
+        user = User.objects.create_user(username='explain_queries_user')
+        FavoriteProduct.objects.create(user=user, product=product)
+        client = Client()
+        client.force_login(user)
+
+        scans = 0
+        for title, url in self.get_pages(product):
+            with CaptureQueriesContext(connection) as queries:
+                client.get(url)
+            flagged = self.explain(queries)
+            self.stdout.write(f'{title} ({url}): запросов {len(queries)}')
+            for table, sql in flagged:
+                self.stdout.write(self.style.WARNING(f'  SCAN {table}: {sql[:200]}'))
+            scans += len(flagged)
+        return scans
+
+    # Функция возвращает [(таблица, sql)] для запросов с полным проходом по таблице
+    def explain(self, queries):
+        flagged = []
+        seen = set()
+        tables = set(connection.introspection.table_names())  # SCAN подзапроса (CO-ROUTINE) не считается
+        with connection.cursor() as cursor:
+            for query in queries:
+                sql = query['sql']
+                if sql in seen or not sql.startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+                    continue
+                seen.add(sql)
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                for row in cursor.fetchall():
+                    match = FULL_SCAN_RE.match(row[-1])
+                    if match and match.group(1) in tables and match.group(1) not in ALLOWED_SCANS:
+                        flagged.append((match.group(1), sql))
+        return flagged
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from digital.payments import process_pending_events
+
+
+# Команда обрабатывает события оплаты, которые не удалось обработать сразу при получении webhook
+class Command(BaseCommand):
+    help = 'Обработать очередь событий оплаты'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно, проверяя очередь')
+        parser.add_argument('--interval', type=float, default=5, help='Пауза между проверками очереди (сек)')
+
+    def handle(self, *args, **options):
+        while True:
+            count = process_pending_events()
+            if count:
+                self.stdout.write(f'Обработано событий: {count}')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
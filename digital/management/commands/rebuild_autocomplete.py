@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from digital.autocomplete import build_snapshot, has_changes
+
+
+# Команда сливает журнал изменений подсказок поиска в новый снимок (запускать по cron или с --loop)
+class Command(BaseCommand):
+    help = 'Слить журнал изменений подсказок поиска в снимок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно, проверяя журнал')
+        parser.add_argument('--interval', type=float, default=300, help='Пауза между проверками (сек)')
+
+    def handle(self, *args, **options):
+        while True:
+            if has_changes() or not options['loop']:
+                build_snapshot()
+                self.stdout.write('Снимок подсказок пересобран')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
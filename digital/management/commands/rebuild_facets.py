@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from digital.facets import rebuild_category_facets
+from digital.models import Category
+
+
+# Команда пересобирает индекс фильтров категорий (например после массового update() товаров)
+class Command(BaseCommand):
+    help = 'Пересобрать индекс фильтров категорий'
+
+    def add_arguments(self, parser):
+        parser.add_argument('slugs', nargs='*', help='Слаги категорий, по умолчанию все')
+
+    def handle(self, *args, **options):
+        categories = None
+        if options['slugs']:
+            categories = Category.objects.filter(slug__in=options['slugs'])
+        rebuild_category_facets(categories)
+        self.stdout.write(self.style.SUCCESS('Индекс фильтров пересобран'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from digital.autocomplete import build_snapshot
+from digital.search import has_fts, rebuild_index
+
+
+# Команда пересобирает поисковый индекс товаров и снимок подсказок поиска (со слиянием журнала изменений)
+# (после установки или массовых изменений через update())
+class Command(BaseCommand):
+    help = 'Пересобрать поисковый индекс товаров'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_index()
+        build_snapshot()
+        backend = 'SQLite FTS5' if has_fts() else 'таблица SearchTerm'
+        self.stdout.write(self.style.SUCCESS(f'Поисковый индекс пересобран ({backend})'))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from digital.stock import release_expired_holds
+
+
+# Команда снимает истёкшие резервы товаров в брошенных корзинах (запускать по cron или с --loop)
+class Command(BaseCommand):
+    help = 'Снять истёкшие резервы товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно, проверяя резервы')
+        parser.add_argument('--interval', type=float, default=60, help='Пауза между проверками (сек)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Сколько резервов снимать за транзакцию')
+
+    def handle(self, *args, **options):
+        while True:
+            count = release_expired_holds(options['batch_size'])
+            if count:
+                self.stdout.write(f'Снято резервов: {count}')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
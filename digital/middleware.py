@@ -0,0 +1,79 @@
+from functools import cached_property
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .models import Customer, Order
+
+
+# Покупатель текущего запроса: находит покупателя и открытый заказ один раз за запрос.
+# id заказа хранится в сессии, поэтому в следующих запросах заказ достаётся одним запросом по pk
+class RequestBuyer:
+    order_session_key = 'cart_order_id'
+
+    def __init__(self, request):
+        self.request = request
+
+    @property
+    def user(self):
+        return self.request.user
+
+    @cached_property
+    def order(self):
+        if not self.user.is_authenticated:
+            return None
+
+        session = self.request.session
+        order_id = session.get(self.order_session_key)
+        if order_id:
+            order = Order.objects.select_related('customer').filter(
+                pk=order_id, customer__user=self.user, is_completed=False
+            ).first()
+            if order:
+                return order
+
+        customer, created = Customer.objects.get_or_create(user=self.user)  # Получ или создадим покупателя
+        order, created = Order.objects.get_or_create(customer=customer, is_completed=False)
+        session[self.order_session_key] = order.pk
+        return order
+
+    @property
+    def customer(self):
+        return self.order.customer if self.order else None
+
+    @property
+    def order_id(self):
+        return self.order.pk if self.order else None
+
+    @property
+    def customer_id(self):
+        return self.order.customer_id if self.order else None
+
+
+# Функция возвращает покупателя запроса (если middleware не подключен, создаёт его на месте)
+def get_buyer(request):
+    buyer = getattr(request, 'buyer', None)
+    if buyer is None:
+        buyer = request.buyer = RequestBuyer(request)
+    return buyer
+
+
+# Middleware добавляет в запрос request.buyer, заказ и покупатель ищутся только при обращении к ним.
+# Сам middleware в базу не ходит, поэтому работает и с асинхронными вьюшками без лишнего потока
+class BuyerMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.buyer = RequestBuyer(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.buyer = RequestBuyer(request)
+        return await self.get_response(request)
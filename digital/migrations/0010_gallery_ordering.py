@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 15:58
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0009_city_order_orderproduct_shippingaddress'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='gallery',
+            options={'ordering': ['pk'], 'verbose_name': 'Картинка Товара', 'verbose_name_plural': 'Картинки Товаров'},
+        ),
+    ]
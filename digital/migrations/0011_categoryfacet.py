@@ -0,0 +1,55 @@
+# Generated by Django 5.2.1 on 2026-10-18 16:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Заполняем индекс фильтров для уже существующих товаров
+def fill_category_facets(apps, schema_editor):
+    Product = apps.get_model('digital', 'Product')
+    CategoryFacet = apps.get_model('digital', 'CategoryFacet')
+    step = settings.FACET_PRICE_STEP
+
+    counts = {}
+    for product in Product.objects.select_related('brand').iterator():
+        facets = {
+            'brand': product.brand.title if product.brand_id else '',
+            'color': product.color_name or '',
+            'price': str(int(product.price // step * step)),
+            'discount': product.discount or '',
+        }
+        for facet, value in facets.items():
+            key = (product.category_id, facet, value)
+            counts[key] = counts.get(key, 0) + 1
+
+    CategoryFacet.objects.bulk_create([
+        CategoryFacet(category_id=category_id, facet=facet, value=value, count=count)
+        for (category_id, facet, value), count in counts.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0010_gallery_ordering'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('brand', 'Бренд'), ('color', 'Цвет'), ('price', 'Цена'), ('discount', 'Скидка')], max_length=20, verbose_name='Фильтр')),
+                ('value', models.CharField(blank=True, default='', max_length=250, verbose_name='Значение')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Кол-во товаров')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='digital.category', verbose_name='Категория')),
+            ],
+            options={
+                'verbose_name': 'Фильтр категории',
+                'verbose_name_plural': 'Фильтры категорий',
+                'constraints': [models.UniqueConstraint(fields=('category', 'facet', 'value'), name='unique_category_facet_value')],
+            },
+        ),
+        migrations.RunPython(fill_category_facets, migrations.RunPython.noop),
+    ]
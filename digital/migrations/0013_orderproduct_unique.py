@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-18 16:05
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+# Перед ограничением склеиваем повторяющиеся строки одного товара в заказе
+def merge_duplicate_order_products(apps, schema_editor):
+    OrderProduct = apps.get_model('digital', 'OrderProduct')
+    duplicates = (OrderProduct.objects.filter(order__isnull=False, product__isnull=False)
+                  .values('order', 'product').annotate(rows=Count('pk'), total=Sum('quantity')).filter(rows__gt=1))
+    for duplicate in list(duplicates):
+        rows = OrderProduct.objects.filter(order=duplicate['order'], product=duplicate['product']).order_by('pk')
+        first = rows.first()
+        rows.exclude(pk=first.pk).delete()
+        rows.filter(pk=first.pk).update(quantity=duplicate['total'] or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0012_product_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_order_products, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='orderproduct',
+            constraint=models.UniqueConstraint(fields=('order', 'product'), name='unique_order_product'),
+        ),
+    ]
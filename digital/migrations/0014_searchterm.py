@@ -0,0 +1,51 @@
+# Generated by Django 5.2.1 on 2026-10-18 16:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+FTS_TABLE = 'digital_product_fts'
+
+
+# Если SQLite собран с FTS5, поиск идёт по виртуальной таблице (rowid = id товара),
+# иначе используется таблица SearchTerm. Заполняется командой rebuild_search_index
+def create_fts_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            return
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(title, model, brand, params, tokenize='unicode61')"
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0013_orderproduct_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(db_index=True, max_length=100, verbose_name='Основа слова')),
+                ('weight', models.PositiveSmallIntegerField(default=1, verbose_name='Вес')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='digital.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Поисковый терм',
+                'verbose_name_plural': 'Поисковый индекс',
+            },
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 16:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0014_searchterm'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['model_product', 'color_cod'], name='product_model_color_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-18 16:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0015_product_variant_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='paid_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата оплаты'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='payment_id',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Сессия оплаты'),
+        ),
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True, verbose_name='id события')),
+                ('type', models.CharField(max_length=100, verbose_name='Тип события')),
+                ('payload', models.JSONField(verbose_name='Данные события')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='Получено')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Обработано')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток обработки')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Ошибка')),
+            ],
+            options={
+                'verbose_name': 'Событие оплаты',
+                'verbose_name_plural': 'События оплаты',
+                'indexes': [models.Index(fields=['processed_at', 'received_at'], name='payment_event_queue_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:10
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+# Перед ограничением удаляем повторы (двойные клики), остаётся самая ранняя строка
+def remove_duplicate_favorites(apps, schema_editor):
+    FavoriteProduct = apps.get_model('digital', 'FavoriteProduct')
+    duplicates = (FavoriteProduct.objects.values('user', 'product')
+                  .annotate(rows=Count('pk'), first=Min('pk')).filter(rows__gt=1))
+    for duplicate in list(duplicates):
+        FavoriteProduct.objects.filter(
+            user=duplicate['user'], product=duplicate['product']
+        ).exclude(pk=duplicate['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0016_payment_events'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_favorites, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='favoriteproduct',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_user_favorite'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0017_favoriteproduct_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='favoriteproduct',
+            name='added_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='favoriteproduct',
+            index=models.Index(fields=['user', '-added_at'], name='favorite_user_added_idx'),
+        ),
+    ]
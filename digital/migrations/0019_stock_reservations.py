@@ -0,0 +1,47 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:05
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+
+# Раньше товар в корзине сразу списывался со склада. Товары неоплаченных корзин возвращаются на склад
+# и становятся резервом, доступное кол-во (quantity - reserved) не меняется
+def convert_carts_to_holds(apps, schema_editor):
+    Product = apps.get_model('digital', 'Product')
+    OrderProduct = apps.get_model('digital', 'OrderProduct')
+    holds = (OrderProduct.objects.exclude(order__is_completed=True)
+             .filter(product__isnull=False, quantity__gt=0))
+    for product_id, quantity in holds.values_list('product_id', 'quantity'):
+        Product.objects.filter(pk=product_id).update(
+            quantity=F('quantity') + quantity, reserved=F('reserved') + quantity
+        )
+    holds.update(reserved_until=timezone.now() + timedelta(seconds=settings.STOCK_HOLD_TTL))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0018_favoriteproduct_added_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reserved',
+            field=models.IntegerField(default=0, verbose_name='В резерве'),
+        ),
+        migrations.AddField(
+            model_name='orderproduct',
+            name='reserved_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Резерв до'),
+        ),
+        migrations.AddIndex(
+            model_name='orderproduct',
+            index=models.Index(fields=['reserved_until'], name='order_product_hold_idx'),
+        ),
+        migrations.RunPython(convert_carts_to_holds, migrations.RunPython.noop),
+    ]
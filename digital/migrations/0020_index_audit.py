@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0019_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='color_cod',
+            field=models.CharField(blank=True, default='#000000', max_length=20, null=True, verbose_name='Код цвета'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='color_name',
+            field=models.CharField(blank=True, default='Чёрный', max_length=100, null=True, verbose_name='Цвет'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('is_completed', False)), fields=['customer'], name='order_open_customer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', '-created_at'], name='product_category_new_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:55
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Round
+
+
+# Перед сменой типа цены округляются до тийинов, чтобы ошибки float не перешли в Decimal
+def round_prices(apps, schema_editor):
+    Product = apps.get_model('digital', 'Product')
+    Product.objects.update(price=Round(F('price'), 2))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0020_index_audit'),
+    ]
+
+    operations = [
+        migrations.RunPython(round_prices, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='price',
+            field=models.DecimalField(decimal_places=2, max_digits=14, verbose_name='Цена'),
+        ),
+    ]
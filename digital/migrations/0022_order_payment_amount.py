@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0021_product_price_decimal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='payment_amount',
+            field=models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Сумма к оплате'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='payment_currency',
+            field=models.CharField(blank=True, default='', max_length=3, verbose_name='Валюта оплаты'),
+        ),
+    ]
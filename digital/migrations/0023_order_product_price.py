@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digital', '0022_order_payment_amount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderproduct',
+            name='price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True, verbose_name='Цена при оформлении'),
+        ),
+    ]
@@ -1,7 +1,15 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.contrib.auth.models import User
 
+from .images import get_variant_urls, get_srcset
+
+# Тип результата денежных выражений в SQL (сумма корзины, сумма строки): сум с тийинами
+PRICE_FIELD = models.DecimalField(max_digits=16, decimal_places=2)
 
 # Create your models here.
 
@@ -15,10 +23,10 @@ class Category(models.Model):
     def get_absolute_url(self):
         return reverse('category_page', kwargs={'slug': self.slug})
 
-    # Метод для получения картинки категории
+    # Метод для получения картинки категории (уменьшенная копия, если она уже создана)
     def get_image_category(self):
         if self.image:
-            return self.image.url
+            return get_variant_urls(self.image).get('thumb', self.image.url)
         else:
             return '-'
 
@@ -34,8 +42,9 @@ class Category(models.Model):
 # Модель товара
 class Product(models.Model):
     title = models.CharField(max_length=150, verbose_name='Название товара')
-    price = models.FloatField(verbose_name='Цена')
+    price = models.DecimalField(max_digits=14, decimal_places=2, verbose_name='Цена')
     quantity = models.IntegerField(default=0, verbose_name='Количество')
+    reserved = models.IntegerField(default=0, verbose_name='В резерве')  # Держат корзины, см. stock.py
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата добавления')
     credit = models.CharField(max_length=250, null=True, blank=True, verbose_name='Рассрочка')
     discount = models.CharField(max_length=250, null=True, blank=True, verbose_name='Скидка')
@@ -44,29 +53,50 @@ class Product(models.Model):
     slug = models.SlugField(unique=True, null=True)
     memory = models.CharField(max_length=250,  verbose_name='Память')
     brand = models.ForeignKey('Brand', on_delete=models.CASCADE, null=True, blank=True, verbose_name='Бренд')
-    color_cod = models.TextField(default='#000000', verbose_name='Код цвета', null=True, blank=True)
-    color_name = models.TextField(default='Чёрный', verbose_name='Цвет', null=True, blank=True)
+    color_cod = models.CharField(max_length=20, default='#000000', verbose_name='Код цвета', null=True, blank=True)
+    color_name = models.CharField(max_length=100, default='Чёрный', verbose_name='Цвет', null=True, blank=True)
     model_product = models.CharField(max_length=255, null=True, blank=True, verbose_name='Модель товара')
 
     def get_absolute_url(self):
         return reverse('product_detail', kwargs={'slug': self.slug})
 
-    # Метод для получения картинки категории
-    def get_image_product(self):
-        if self.images:
+    # Сколько товара можно положить в корзину: на складе минус резервы корзин
+    @property
+    def available(self):
+        return max(self.quantity - self.reserved, 0)
+
+    # Метод для получения картинки товара размера карточки
+    def get_image_product(self, size='card'):
+        images = self.images.all()  # Если картинки были загружены через prefetch_related, запроса не будет
+        if images:
             try:
-                return self.images.first().image.url
+                return images[0].get_image_url(size)
             except:
                 return '-'
         else:
             return '-'
 
+    # Метод для получения srcset главной картинки товара (пустая строка если копий ещё нет)
+    def get_image_srcset(self):
+        images = self.images.all()
+        return images[0].get_srcset() if images else ''
+
     def __str__(self):
         return self.title
 
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
+        # Индексы для фильтров страницы категории
+        indexes = [
+            models.Index(fields=['category', 'price'], name='product_category_price_idx'),
+            # Сортировка "новинки" в категории, похожие товары и новинки на главной
+            models.Index(fields=['category', '-created_at'], name='product_category_new_idx'),
+            models.Index(fields=['category', 'brand'], name='product_category_brand_idx'),
+            models.Index(fields=['category', 'color_name'], name='product_category_color_idx'),
+            # Варианты модели по цветам
+            models.Index(fields=['model_product', 'color_cod'], name='product_model_color_idx'),
+        ]
 
 
 # Меодель Галереи картинок товаров
@@ -74,7 +104,15 @@ class Gallery(models.Model):
     image = models.ImageField(upload_to='products/', verbose_name='Картинка товара')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
 
+    # Ссылка на копию картинки нужного размера (thumb, card, detail), пока копий нет - оригинал
+    def get_image_url(self, size='card'):
+        return get_variant_urls(self.image).get(size, self.image.url)
+
+    def get_srcset(self):
+        return get_srcset(self.image)
+
     class Meta:
+        ordering = ['pk']  # Первая картинка галереи - главная картинка товара
         verbose_name = 'Картинка Товара'
         verbose_name_plural = 'Картинки Товаров'
 
@@ -106,10 +144,55 @@ class Brand(models.Model):
 
 
 
+# Индекс фильтров категории: значения бренда, цвета, цены и скидки с кол-вом товаров.
+# Обновляется сигналами при сохранении и удалении товара (см. facets.py)
+class CategoryFacet(models.Model):
+    BRAND = 'brand'
+    COLOR = 'color'
+    PRICE = 'price'
+    DISCOUNT = 'discount'
+    FACET_CHOICES = [
+        (BRAND, 'Бренд'),
+        (COLOR, 'Цвет'),
+        (PRICE, 'Цена'),
+        (DISCOUNT, 'Скидка'),
+    ]
+
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='facets', verbose_name='Категория')
+    facet = models.CharField(max_length=20, choices=FACET_CHOICES, verbose_name='Фильтр')
+    value = models.CharField(max_length=250, blank=True, default='', verbose_name='Значение')
+    count = models.PositiveIntegerField(default=0, verbose_name='Кол-во товаров')
+
+    def __str__(self):
+        return f'{self.category} {self.facet}: {self.value} ({self.count})'
+
+    class Meta:
+        verbose_name = 'Фильтр категории'
+        verbose_name_plural = 'Фильтры категорий'
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'facet', 'value'], name='unique_category_facet_value')
+        ]
+
+
+# Поисковый индекс товаров для баз без SQLite FTS5: основа слова -> товар с весом (см. search.py)
+class SearchTerm(models.Model):
+    term = models.CharField(max_length=100, db_index=True, verbose_name='Основа слова')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_terms', verbose_name='Товар')
+    weight = models.PositiveSmallIntegerField(default=1, verbose_name='Вес')
+
+    def __str__(self):
+        return f'{self.term} {self.product_id}'
+
+    class Meta:
+        verbose_name = 'Поисковый терм'
+        verbose_name_plural = 'Поисковый индекс'
+
+
 # Моделька Избранное
 class FavoriteProduct(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Пользоваель')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name='Товар')
+    added_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата добавления')
 
     def __str__(self):
         return f'Продукт {self.product.title}, {self.user.username}'
@@ -117,6 +200,13 @@ class FavoriteProduct(models.Model):
     class Meta:
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранные товары'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_user_favorite')
+        ]
+        indexes = [
+            # Страница избранного: товары пользователя от последних добавленных
+            models.Index(fields=['user', '-added_at'], name='favorite_user_added_idx'),
+        ]
 
 
 
@@ -147,6 +237,11 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата заказа')
     is_completed = models.BooleanField(default=False, verbose_name='Выполнен ли заказа')
     shipping = models.BooleanField(default=True, verbose_name='Доставка')
+    paid_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата оплаты')
+    payment_id = models.CharField(max_length=255, blank=True, default='', verbose_name='Сессия оплаты')
+    # Сумма и валюта сессии оплаты на момент оформления, с ними сверяется событие оплаты
+    payment_amount = models.PositiveBigIntegerField(null=True, blank=True, verbose_name='Сумма к оплате')
+    payment_currency = models.CharField(max_length=3, blank=True, default='', verbose_name='Валюта оплаты')
 
     def __str__(self):
         return f'Заказ №: {self.pk}'
@@ -155,19 +250,30 @@ class Order(models.Model):
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
+        indexes = [
+            # Корзина покупателя: незавершённый заказ (BuyerMiddleware). Завершённых заказов в индексе нет
+            models.Index(fields=['customer'], condition=models.Q(is_completed=False), name='order_open_customer_idx'),
+        ]
 
     # ------------------------------  Здесь будут метода подсчёта заказа
+    # Метод считает сумму и кол-во товаров заказа одним запросом SUM(price * quantity)
+    # и запоминает результат на объекте, чтобы шаблоны не пересчитывали его
+    def get_cart_totals(self):
+        if not hasattr(self, '_cart_totals'):
+            self._cart_totals = self.orderproduct_set.aggregate(
+                total_price=Coalesce(Sum(F('product__price') * F('quantity'), output_field=PRICE_FIELD), Decimal(0),
+                                     output_field=PRICE_FIELD),
+                total_quantity=Coalesce(Sum('quantity'), 0)
+            )
+        return self._cart_totals
+
     @property # Метод для полкчения суммы Заказа
     def get_cart_total_price(self):
-        order_products = self.orderproduct_set.all()
-        total_price = sum([product.get_total_price for product in order_products])
-        return total_price
+        return self.get_cart_totals()['total_price']
 
     @property  # Метод для полкчения кол-ва заказанных товаров
     def get_cart_total_quantity(self):
-        order_products = self.orderproduct_set.all()
-        total_quantity = sum([product.quantity for product in order_products])
-        return total_quantity
+        return self.get_cart_totals()['total_quantity']
 
 
 
@@ -179,6 +285,10 @@ class OrderProduct(models.Model):
     order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True)
     quantity = models.IntegerField(default=0, null=True, blank=True, verbose_name='Кол-во')
     added_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата добавления')
+    reserved_until = models.DateTimeField(null=True, blank=True, verbose_name='Резерв до')
+    # Цена товара на момент оформления заказа, с ней webhook сверяет оплаченную корзину
+    price = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True,
+                                verbose_name='Цена при оформлении')
 
 
     def __str__(self):
@@ -187,13 +297,46 @@ class OrderProduct(models.Model):
     class Meta:
         verbose_name = 'Заказанны товар'
         verbose_name_plural = 'Заказанные товары'
-
-
-    # Метод который вернёт сумму товара в его кол-ве
+        # Один товар в заказе - одна строка, кол-во меняется в ней
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='unique_order_product')
+        ]
+        indexes = [
+            # Поиск истёкших резервов (release_expired_holds)
+            models.Index(fields=['reserved_until'], name='order_product_hold_idx'),
+        ]
+
+
+    # Метод который вернёт сумму товара в его кол-ве. Для корзины сумма строки уже посчитана
+    # в SQL (аннотация total_price в get_cart_info)
     @property
     def get_total_price(self):
-        total_price = self.product.price * self.quantity
-        return total_price
+        if hasattr(self, 'total_price'):
+            return self.total_price
+        return self.product.price * self.quantity
+
+
+
+# Очередь событий платёжной системы (webhook). Событие сохраняется до обработки,
+# поэтому не теряется при ошибке, а повторно присланное событие не обрабатывается дважды
+class PaymentEvent(models.Model):
+    event_id = models.CharField(max_length=255, unique=True, verbose_name='id события')
+    type = models.CharField(max_length=100, verbose_name='Тип события')
+    payload = models.JSONField(verbose_name='Данные события')
+    received_at = models.DateTimeField(auto_now_add=True, verbose_name='Получено')
+    processed_at = models.DateTimeField(null=True, blank=True, verbose_name='Обработано')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток обработки')
+    error = models.TextField(blank=True, default='', verbose_name='Ошибка')
+
+    def __str__(self):
+        return f'{self.type} {self.event_id}'
+
+    class Meta:
+        verbose_name = 'Событие оплаты'
+        verbose_name_plural = 'События оплаты'
+        indexes = [
+            models.Index(fields=['processed_at', 'received_at'], name='payment_event_queue_idx'),
+        ]
 
 
 
@@ -0,0 +1,158 @@
+import base64
+import datetime
+import hashlib
+import json
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+# Варианты сортировки для постраничного вывода по курсору: (поле, pk) в одном направлении
+SORTS = {
+    'new': ('-created_at', '-pk'),
+    'price': ('price', 'pk'),
+    'price_desc': ('-price', '-pk'),
+}
+
+
+# Функция возвращает кол-во объектов из кэша, чтобы COUNT(*) не выполнялся на каждой странице
+def get_cached_count(queryset):
+    sql, params = queryset.query.sql_with_params()
+    key = 'count:' + hashlib.md5(f'{sql}{params}'.encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, settings.CATALOG_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+# Постраничный вывод по курсору. Сортировать можно и по аннотации queryset.
+# count можно передать готовым, если кол-во уже известно (например из кэша), тогда COUNT(*) не выполняется
+# DjangoJSONEncoder обрезает время до миллисекунд, а курсор должен совпадать со значением в базе точно:
+# иначе товары с тем же миллисекундным временем пропускаются или повторяются на соседних страницах
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, per_page, ordering=SORTS['new'], count=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = ordering
+        self._count = count
+
+    @property
+    def count(self):
+        if self._count is None:
+            self._count = get_cached_count(self.queryset)
+        return self._count
+
+    @property
+    def num_pages(self):
+        return max(1, math.ceil(self.count / self.per_page))
+
+    def get_field(self, name):
+        name = name.lstrip('-')
+        meta = self.queryset.model._meta
+        if name in self.queryset.query.annotations:
+            return self.queryset.query.annotations[name].output_field
+        return meta.pk if name == 'pk' else meta.get_field(name)
+
+    def encode_cursor(self, obj, direction):
+        values = [getattr(obj, name.lstrip('-')) for name in self.ordering]
+        data = json.dumps([direction, values], cls=CursorEncoder)
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            direction, values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values = [self.get_field(name).to_python(value) for name, value in zip(self.ordering, values)]
+        except (TypeError, ValueError, ValidationError):
+            return None, None
+        if direction not in ('next', 'prev') or len(values) != len(self.ordering):
+            return None, None
+        return direction, values
+
+    # Условие "после курсора" для сортировки (a, b): a > x OR (a = x AND b > y)
+    def get_after_q(self, values, reverse=False):
+        q = Q()
+        for i, name in enumerate(self.ordering):
+            descending = name.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            condition = Q(**{f'{name.lstrip("-")}__{lookup}': values[i]})
+            for prev_name, prev_value in zip(self.ordering[:i], values[:i]):
+                condition &= Q(**{prev_name.lstrip('-'): prev_value})
+            q |= condition
+        return q
+
+    def page(self, cursor=None, number=1):
+        direction, values = self.decode_cursor(cursor) if cursor else (None, None)
+        if direction is None:
+            number = 1
+        number = max(1, number)
+
+        queryset = self.queryset.order_by(*self.ordering)
+        if direction == 'prev':
+            reverse_ordering = [name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering]
+            queryset = self.queryset.order_by(*reverse_ordering).filter(self.get_after_q(values, reverse=True))
+        elif direction == 'next':
+            queryset = queryset.filter(self.get_after_q(values))
+
+        object_list = list(queryset[:self.per_page + 1])  # Лишний объект показывает есть ли ещё страница
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+
+        if direction == 'prev':
+            object_list.reverse()
+            number = number if has_more else 1  # Дошли до начала списка
+            return KeysetPage(object_list, number, self, has_next=True, has_previous=has_more)
+        return KeysetPage(object_list, number, self, has_next=has_more, has_previous=direction is not None)
+
+
+# Страница постраничного вывода по курсору, по интерфейсу похожа на страницу Django Paginator
+class KeysetPage:
+    is_keyset = True
+
+    def __init__(self, object_list, number, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return max(1, self.number - 1)
+
+    @property
+    def next_cursor(self):
+        return self.paginator.encode_cursor(self.object_list[-1], 'next') if self.has_next() else ''
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous() or not self.object_list:
+            return ''
+        return self.paginator.encode_cursor(self.object_list[0], 'prev')
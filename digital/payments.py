@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import PRICE_FIELD, Order, PaymentEvent, Product
+from .stock import sell_order
+
+# Платёжные шлюзы. Шлюз выбирается настройкой PAYMENT_GATEWAY:
+# StripeGateway - настоящая оплата, FakeGateway - локальная замена Stripe для разработки и нагрузочных тестов
+
+# Созданная сессия оплаты: id и ссылка на страницу оплаты
+CheckoutSession = namedtuple('CheckoutSession', ['id', 'url'])
+
+
+class PaymentError(Exception):
+    pass
+
+
+# Ключ идемпотентности заказа: повторная отправка формы (двойной клик, повтор после таймаута)
+# возвращает ту же сессию оплаты. В ключ входит сумма, чтобы после изменения корзины создавалась новая сессия
+def get_idempotency_key(order, amount):
+    digest = hashlib.sha256(f'{order.pk}:{amount}'.encode()).hexdigest()[:16]
+    return f'order-{order.pk}-{digest}'
+
+
+# Валюты Stripe без дробной части: сумма передаётся в целых единицах, у остальных - в сотых (центах)
+ZERO_DECIMAL_CURRENCIES = {'bif', 'clp', 'djf', 'gnf', 'jpy', 'kmf', 'krw', 'mga', 'pyg', 'rwf', 'ugx', 'vnd', 'vuv',
+                           'xaf', 'xof', 'xpf'}
+
+
+# Сумма для платёжной системы в минимальных единицах валюты. Считается в Decimal, без ошибок округления float
+def get_amount(total_price):
+    exponent = 0 if settings.PAYMENT_CURRENCY.lower() in ZERO_DECIMAL_CURRENCIES else 2
+    amount = Decimal(str(total_price)).scaleb(exponent)
+    return int(amount.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+# Функция запоминает на заказе сумму и валюту создаваемой сессии оплаты, а в строках заказа - цены товаров
+def set_payment_amount(order, amount):
+    order.payment_amount = amount
+    order.payment_currency = settings.PAYMENT_CURRENCY.lower()
+    order.save(update_fields=['payment_amount', 'payment_currency'])
+    order.orderproduct_set.update(price=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price')))
+
+
+class PaymentGateway(ABC):
+    @abstractmethod
+    async def create_checkout_session(self, order, amount, success_url, cancel_url):
+        pass
+
+
+class StripeGateway(PaymentGateway):
+    def __init__(self):
+        self.clients = {}
+
+    # Клиент Stripe на цикл событий: HTTP соединения httpx привязаны к циклу в котором открыты.
+    # Под ASGI цикл один на процесс и соединения переиспользуются, под WSGI у каждого запроса свой цикл,
+    # клиенты закрытых циклов забываются. Stripe сам повторяет запрос при сетевых ошибках и 5xx
+    # с тем же ключом идемпотентности
+    def get_client(self):
+        for loop in [loop for loop in list(self.clients) if loop.is_closed()]:
+            self.clients.pop(loop, None)
+        loop = asyncio.get_running_loop()
+        if loop not in self.clients:
+            self.clients[loop] = stripe.StripeClient(
+                settings.STRIPE_SECRET_KEY,
+                http_client=stripe.HTTPXClient(timeout=settings.PAYMENT_TIMEOUT),
+                max_network_retries=settings.PAYMENT_MAX_RETRIES,
+            )
+        return self.clients[loop]
+
+    async def create_checkout_session(self, order, amount, success_url, cancel_url):
+        params = {
+            'line_items': [{
+                'price_data': {
+                    'currency': settings.PAYMENT_CURRENCY.lower(),
+                    'product_data': {
+                        'name': 'DigitalStore товары'
+                    },
+                    'unit_amount': amount
+                },
+                'quantity': 1
+            }],
+            'mode': 'payment',
+            'client_reference_id': str(order.pk),
+            'metadata': {'order_id': str(order.pk)},
+            'success_url': f'{success_url}?session_id={{CHECKOUT_SESSION_ID}}',
+            'cancel_url': cancel_url,
+        }
+        try:
+            session = await self.get_client().checkout.sessions.create_async(
+                params, {'idempotency_key': get_idempotency_key(order, amount)}
+            )
+        except stripe.StripeError as error:
+            raise PaymentError(str(error)) from error
+        return CheckoutSession(session.id, session.url)
+
+
+# Локальная замена Stripe: сразу "оплачивает" заказ (кладёт в очередь такое же событие, какое прислал бы
+# webhook Stripe) и ведёт на страницу успешной оплаты. PAYMENT_FAKE_DELAY имитирует время ответа платёжной системы
+class FakeGateway(PaymentGateway):
+    def __init__(self):
+        self.sessions = {}
+
+    async def create_checkout_session(self, order, amount, success_url, cancel_url):
+        if settings.PAYMENT_FAKE_DELAY:
+            await asyncio.sleep(settings.PAYMENT_FAKE_DELAY)
+        key = get_idempotency_key(order, amount)
+        if key not in self.sessions:
+            session_id = f'cs_fake_{len(self.sessions) + 1}'
+            self.sessions[key] = CheckoutSession(session_id, f'{success_url}?session_id={session_id}')
+            await sync_to_async(receive_event)({
+                'id': f'evt_fake_{session_id}',
+                'type': 'checkout.session.completed',
+                'data': {'object': {
+                    'id': session_id, 'payment_status': 'paid', 'metadata': {'order_id': str(order.pk)},
+                    'amount_total': amount, 'currency': settings.PAYMENT_CURRENCY.lower(),
+                }},
+            })
+        return self.sessions[key]
+
+
+# Один экземпляр шлюза на процесс (у StripeGateway внутри клиенты с пулами HTTP соединений)
+@lru_cache(maxsize=None)
+def load_gateway(path):
+    return import_string(path)()
+
+
+def get_gateway():
+    return load_gateway(settings.PAYMENT_GATEWAY)
+
+
+# ------------------------------ Очередь событий оплаты
+
+# События после которых заказ считается оплаченным
+PAID_EVENTS = ('checkout.session.completed', 'checkout.session.async_payment_succeeded')
+
+
+# Функция сохраняет событие в очередь и сразу пробует его обработать.
+# Повторно присланное событие (Stripe повторяет webhook пока не получит ответ 200) не сохраняется второй раз
+def receive_event(event):
+    try:
+        with transaction.atomic():
+            payment_event = PaymentEvent.objects.create(event_id=event['id'], type=event['type'], payload=event)
+    except IntegrityError:
+        return None
+    transaction.on_commit(lambda: process_event(payment_event.pk))
+    return payment_event
+
+
+# Функция помечает заказ оплаченным и списывает его товары со склада (резерв -> продажа). Условный UPDATE
+# по is_completed=False: повтор события ничего не меняет. Вернёт True если заказ был завершён этим вызовом
+def complete_order(order_id, payment_id):
+    with transaction.atomic():
+        completed = bool(Order.objects.filter(pk=order_id, is_completed=False).update(
+            is_completed=True, paid_at=timezone.now(), payment_id=payment_id
+        ))
+        if completed:
+            sell_order(order_id)
+    return completed
+
+
+# Функция сверяет оплаченную сумму с суммой заказа на момент оформления и с корзиной заказа по ценам оформления
+# (изменение цен каталога после оформления не мешает завершить оплаченный заказ). Если корзину изменили
+# после оформления, заказ не завершается, событие остаётся в очереди с ошибкой
+def check_payment_amount(order_id, session):
+    order = Order.objects.get(pk=order_id)
+    paid = (session['amount_total'], session['currency'])
+    if order.payment_amount is None or paid != (order.payment_amount, order.payment_currency):
+        raise PaymentError(f'Оплачено {paid[0]} {paid[1]}, к оплате {order.payment_amount} {order.payment_currency}')
+    lines = order.orderproduct_set.filter(quantity__gt=0).aggregate(
+        total=Sum(F('price') * F('quantity'), output_field=PRICE_FIELD),
+        added=Count('pk', filter=Q(price=None, product__isnull=False)),  # Добавлены после оформления
+    )
+    cart_amount = get_amount(lines['total'] or 0)
+    if lines['added'] or cart_amount != order.payment_amount:
+        raise PaymentError(f'Корзина заказа изменилась после оформления: {cart_amount}, оплачено {paid[0]}')
+
+
+def process_event(event_id):
+    with transaction.atomic():
+        event = PaymentEvent.objects.select_for_update().filter(pk=event_id, processed_at=None).first()
+        if event is None:  # Уже обработано
+            return
+        event.attempts += 1
+        try:
+            with transaction.atomic():
+                if event.type in PAID_EVENTS:
+                    session = event.payload['data']['object']
+                    if session.get('payment_status') != 'unpaid':
+                        order_id = int(session.get('metadata', {}).get('order_id') or session['client_reference_id'])
+                        check_payment_amount(order_id, session)
+                        complete_order(order_id, session['id'])
+        except (KeyError, TypeError, ValueError, Order.DoesNotExist, PaymentError) as error:
+            event.error = f'{type(error).__name__}: {error}'
+            event.save(update_fields=['attempts', 'error'])
+            return
+        event.processed_at = timezone.now()
+        event.error = ''
+        event.save(update_fields=['attempts', 'processed_at', 'error'])
+
+
+# Функция обрабатывает необработанные события очереди (команда process_payment_events)
+def process_pending_events():
+    events = PaymentEvent.objects.filter(
+        processed_at=None, attempts__lt=settings.PAYMENT_EVENT_MAX_ATTEMPTS
+    ).order_by('received_at').values_list('pk', flat=True)
+    count = 0
+    for event_id in list(events):
+        process_event(event_id)
+        count += 1
+    return count
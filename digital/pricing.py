@@ -0,0 +1,49 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Round
+
+from .cache import bump_cache_versions
+from .facets import rebuild_category_facets
+from .models import Product
+
+# Массовое изменение цен. update() и bulk_update() не отправляют сигналы, поэтому после коммита
+# сбрасываются закэшированные карточки товаров и пересобираются фильтры по цене их категорий
+
+PRICE_STEP = Decimal('0.01')
+
+
+def to_price(value):
+    return Decimal(str(value)).quantize(PRICE_STEP, rounding=ROUND_HALF_UP)
+
+
+def reset_prices(rows):
+    bump_cache_versions(f'product:{product_id}' for product_id, category_id in rows)
+    rebuild_category_facets({category_id for product_id, category_id in rows})
+
+
+# Функция меняет цены товаров queryset на percent процентов (-10 - скидка 10%) одним UPDATE:
+# price = ROUND(price * (1 + percent / 100), 2). Вернёт кол-во изменённых товаров
+def change_prices(products, percent):
+    factor = 1 + to_price(percent) / 100
+    with transaction.atomic():
+        rows = list(products.values_list('pk', 'category_id'))
+        Product.objects.filter(pk__in=[product_id for product_id, category_id in rows]).update(
+            price=Round(F('price') * factor, 2)
+        )
+        transaction.on_commit(lambda: reset_prices(rows))
+    return len(rows)
+
+
+# Функция ставит товарам новые цены {product_id: цена}. UPDATE ... SET price = CASE id WHEN ... END
+# пачками (bulk_update), запросов столько, сколько пачек, а не товаров. Вернёт кол-во изменённых товаров
+def set_prices(prices):
+    with transaction.atomic():
+        products = list(Product.objects.filter(pk__in=prices).only('pk', 'category_id'))
+        for product in products:
+            product.price = to_price(prices[product.pk])
+        Product.objects.bulk_update(products, ['price'])
+        rows = [(product.pk, product.category_id) for product in products]
+        transaction.on_commit(lambda: reset_prices(rows))
+    return len(rows)
@@ -0,0 +1,30 @@
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Product
+from .utils import get_card_products
+
+
+# Функция возвращает пул id товаров категории для блока "Похожие товары".
+# Пул хранится в кэше недолго, чтобы новые товары быстро попадали в выборку
+def get_category_pool(category_id):
+    key = f'related_pool:{category_id}'
+    pool = cache.get(key)
+    if pool is None:
+        pool = list(Product.objects.filter(category_id=category_id).order_by('-created_at', '-pk')
+                    .values_list('pk', flat=True)[:settings.RELATED_POOL_SIZE])
+        cache.set(key, pool, settings.RELATED_PRODUCTS_CACHE_TIMEOUT)
+    return pool
+
+
+# Функция возвращает случайные товары той же категории без повторов и без самого товара.
+# Товары для карточек выбираются одним запросом
+def get_related_products(product, limit=None):
+    limit = limit or settings.RELATED_PRODUCTS_LIMIT
+    pool = [pk for pk in get_category_pool(product.category_id) if pk != product.pk]
+    ids = random.sample(pool, min(limit, len(pool)))
+
+    products = {p.pk: p for p in get_card_products(Product.objects.filter(pk__in=ids))}
+    return [products[pk] for pk in ids if pk in products]
@@ -0,0 +1,164 @@
+import re
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Max, Q, Sum, When
+
+from .models import Product, SearchTerm
+from .utils import get_card_products
+
+FTS_TABLE = 'digital_product_fts'
+
+# Вес полей товара в поиске: название важнее модели и бренда, характеристики важны меньше всего
+WEIGHTS = {
+    'title': 3,
+    'model': 2,
+    'brand': 2,
+    'params': 1,
+}
+
+RU_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией', 'ий', 'ый', 'ой', 'ей', 'ая', 'яя',
+    'ое', 'ее', 'ые', 'ие', 'ых', 'их', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ов', 'ев', 'ию', 'ью', 'ия', 'ья',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+EN_ENDINGS = ['ing', 'ed', 's']
+
+
+# Функция отрезает окончание слова (простой стеммер для русского и английского)
+def stem(word):
+    endings = RU_ENDINGS if re.search('[а-я]', word) else EN_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+# Функция разбивает текст на слова и приводит их к основе: "Чёрные смартфоны" -> ['черн', 'смартфон']
+def tokenize(text):
+    words = re.findall(r'\w+', (text or '').lower().replace('ё', 'е'))
+    return [stem(word) for word in words]
+
+
+# Функция возвращает текст товара для поиска по полям: {'title': 'основы слов ...', ...}
+def get_product_document(product):
+    params = ' '.join(f'{p.parameter} {p.parameter_info}' for p in product.parameters.all())
+    fields = {
+        'title': product.title,
+        'model': product.model_product,
+        'brand': product.brand.title if product.brand_id else '',
+        'params': params,
+    }
+    return {field: ' '.join(tokenize(text)) for field, text in fields.items()}
+
+
+_fts_available = None
+
+
+# Есть ли в базе таблица SQLite FTS5 (создаётся миграцией если SQLite собран с FTS5)
+def has_fts():
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+    return _fts_available
+
+
+# Функция обновляет товар в поисковом индексе (вызывается сигналами при сохранении товара)
+def index_product(product_id):
+    product = Product.objects.select_related('brand').prefetch_related('parameters').filter(pk=product_id).first()
+    if product is None:
+        return remove_product(product_id)
+    document = get_product_document(product)
+
+    if has_fts():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, model, brand, params) VALUES (%s, %s, %s, %s, %s)',
+                [product_id, document['title'], document['model'], document['brand'], document['params']]
+            )
+        return
+
+    # Без FTS5 - своя таблица термов: (основа слова, товар, вес)
+    weights = {}
+    for field, text in document.items():
+        for term in text.split():
+            weights[term] = weights.get(term, 0) + WEIGHTS[field]
+    SearchTerm.objects.filter(product_id=product_id).delete()
+    SearchTerm.objects.bulk_create([
+        SearchTerm(term=term[:100], product_id=product_id, weight=weight) for term, weight in weights.items()
+    ])
+
+
+def remove_product(product_id):
+    if has_fts():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+    else:
+        SearchTerm.objects.filter(product_id=product_id).delete()
+
+
+def rebuild_index():
+    if has_fts():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    else:
+        SearchTerm.objects.all().delete()
+    for product_id in Product.objects.values_list('pk', flat=True).iterator():
+        index_product(product_id)
+
+
+# Функция ищет товары и возвращает (id товаров страницы по релевантности, всего найдено).
+# Каждое слово запроса ищется как начало слова, товар должен содержать все слова
+def search_product_ids(query, offset=0, limit=20):
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return [], 0
+
+    if has_fts():
+        match = ' '.join(f'"{term}"*' for term in terms)
+        weights = ', '.join(str(weight) for weight in WEIGHTS.values())
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+            total = cursor.fetchone()[0]
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s OFFSET %s',
+                [match, limit, offset]
+            )
+            return [row[0] for row in cursor.fetchall()], total
+
+    matched = {
+        f'matched_{i}': Max(Case(When(term__startswith=term, then=1), default=0, output_field=IntegerField()))
+        for i, term in enumerate(terms)
+    }
+    condition = Q()
+    for term in terms:
+        condition |= Q(term__startswith=term)
+    rows = SearchTerm.objects.filter(condition).values('product').annotate(score=Sum('weight'), **matched)
+    rows = rows.filter(**{name: 1 for name in matched})
+    total = rows.count()
+    ids = rows.order_by('-score', 'product').values_list('product', flat=True)[offset:offset + limit]
+    return list(ids), total
+
+
+# Результаты поиска для Paginator: кол-во и срезы страниц, товары страницы грузятся одним запросом
+class SearchResults:
+    def __init__(self, query):
+        self.query = query
+        self._total = None
+
+    def count(self):
+        if self._total is None:
+            ids, self._total = search_product_ids(self.query, limit=0)
+        return self._total
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        offset = index.start or 0
+        ids, self._total = search_product_ids(self.query, offset, index.stop - offset)
+        products = {product.pk: product for product in get_card_products(Product.objects.filter(pk__in=ids))}
+        return [products[pk] for pk in ids if pk in products]
@@ -0,0 +1,202 @@
+from django.db.models import QuerySet
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .autocomplete import KIND_BRAND, KIND_CATEGORY, KIND_PRODUCT, schedule_changes
+from .cache import bump_cache_version
+from .catalog import get_variants_cache_name
+from .favorites import reset_favorites
+from .models import Product, Brand, Category, Gallery, ProductDescription, FavoriteProduct
+from .images import schedule_variants
+from .facets import get_product_facets, update_category_facets, rebuild_category_facets
+from .search import index_product, remove_product
+
+
+# Перед сохранением товара запоминаем его старые значения фильтров, модель и подсказку поиска (slug, название)
+@receiver(pre_save, sender=Product)
+def remember_product_facets(sender, instance, raw=False, **kwargs):
+    instance._old_facets = None
+    instance._old_model_product = None
+    instance._old_autocomplete = None
+    if raw or not instance.pk:
+        return
+    old_product = Product.objects.filter(pk=instance.pk).select_related('brand').first()
+    if old_product:
+        instance._old_facets = (old_product.category_id, get_product_facets(old_product))
+        instance._old_model_product = old_product.model_product
+        instance._old_autocomplete = (old_product.slug, old_product.title)
+
+
+# После сохранения товара переносим его в индексе фильтров со старых значений на новые
+@receiver(post_save, sender=Product)
+def update_product_facets(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    new_facets = (instance.category_id, get_product_facets(instance))
+    old_facets = getattr(instance, '_old_facets', None)
+    if old_facets == new_facets:
+        return
+    if old_facets:
+        update_category_facets(*old_facets, delta=-1)
+    update_category_facets(*new_facets, delta=1)
+
+
+@receiver(post_delete, sender=Product)
+def delete_product_facets(sender, instance, **kwargs):
+    try:
+        facets = get_product_facets(instance)
+    except Brand.DoesNotExist:  # Бренд уже удалён вместе с категорией
+        return
+    update_category_facets(instance.category_id, facets, delta=-1)
+
+
+# При переименовании бренда пересобираем фильтры категорий где есть его товары
+@receiver(post_save, sender=Brand)
+def update_brand_facets(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    categories = Product.objects.filter(brand=instance).values('category').distinct()
+    rebuild_category_facets(categories)
+
+
+# При изменении категорий сбрасываем дерево категорий в кэше
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def reset_category_tree(sender, **kwargs):
+    bump_cache_version('category_tree')
+
+
+# При изменении товаров сбрасываем новинки главной страницы
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def reset_new_arrivals(sender, **kwargs):
+    bump_cache_version('new_arrivals')
+
+
+# Закэшированные фрагменты товара (карточка, характеристики) сбрасываются при изменении товара,
+# его картинок, характеристик или бренда
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def reset_product_fragments(sender, instance, **kwargs):
+    bump_cache_version(f'product:{instance.pk}')
+
+
+# Варианты модели сбрасываются и у старой модели товара, если модель поменяли
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def reset_product_variants(sender, instance, **kwargs):
+    models = {instance.model_product, getattr(instance, '_old_model_product', None)}
+    for model_product in models - {None, ''}:
+        bump_cache_version(get_variants_cache_name(model_product))
+
+
+@receiver(post_save, sender=Gallery)
+@receiver(post_delete, sender=Gallery)
+@receiver(post_save, sender=ProductDescription)
+@receiver(post_delete, sender=ProductDescription)
+def reset_product_related_fragments(sender, instance, **kwargs):
+    bump_cache_version(f'product:{instance.product_id}')
+
+
+@receiver(post_save, sender=Brand)
+def reset_brand_fragments(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    for product_id in Product.objects.filter(brand=instance).values_list('pk', flat=True):
+        bump_cache_version(f'product:{product_id}')
+
+
+# Поисковый индекс обновляется по одному товару при изменении товара, его характеристик или бренда
+@receiver(post_save, sender=Product)
+def update_product_search(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_product(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def delete_product_search(sender, instance, **kwargs):
+    remove_product(instance.pk)
+
+
+# Характеристики удалённые каскадом вместе с товаром (origin - удаляемый товар или категория) не индексируются:
+# товар убирает из индекса delete_product_search
+@receiver(post_save, sender=ProductDescription)
+@receiver(post_delete, sender=ProductDescription)
+def update_parameters_search(sender, instance, raw=False, origin=None, **kwargs):
+    if raw:
+        return
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin is None or origin_model is ProductDescription:
+        index_product(instance.product_id)
+
+
+@receiver(post_save, sender=Brand)
+def update_brand_search(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    for product_id in Product.objects.filter(brand=instance).values_list('pk', flat=True):
+        index_product(product_id)
+
+
+# Изменённые подсказки поиска записываются в журнал после коммита (см. autocomplete.py). Сохранение
+# без изменения slug и названия подсказки не трогает
+@receiver(pre_save, sender=Category)
+def remember_category_autocomplete(sender, instance, raw=False, **kwargs):
+    instance._old_autocomplete = None
+    if not raw and instance.pk:
+        instance._old_autocomplete = Category.objects.filter(pk=instance.pk).values_list('slug', 'title').first()
+
+
+@receiver(pre_save, sender=Brand)
+def remember_brand_autocomplete(sender, instance, raw=False, **kwargs):
+    instance._old_autocomplete = None
+    if not raw and instance.pk:
+        instance._old_autocomplete = Brand.objects.filter(pk=instance.pk).values_list('title', flat=True).first()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+def update_autocomplete(sender, instance, raw=False, **kwargs):
+    old = getattr(instance, '_old_autocomplete', None)
+    if not raw and old != (instance.slug, instance.title):
+        kind = KIND_PRODUCT if sender is Product else KIND_CATEGORY
+        schedule_changes(kind, instance.slug, old and old[0])
+
+
+@receiver(post_save, sender=Brand)
+def update_brand_autocomplete(sender, instance, raw=False, **kwargs):
+    old = getattr(instance, '_old_autocomplete', None)
+    if not raw and old != instance.title:
+        schedule_changes(KIND_BRAND, instance.title, old)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+def delete_autocomplete(sender, instance, **kwargs):
+    schedule_changes(KIND_PRODUCT if sender is Product else KIND_CATEGORY, instance.slug)
+
+
+@receiver(post_delete, sender=Brand)
+def delete_brand_autocomplete(sender, instance, **kwargs):
+    schedule_changes(KIND_BRAND, instance.title)
+
+
+# После загрузки картинки товара или категории создаются её уменьшенные копии (см. images.py)
+@receiver(post_save, sender=Gallery)
+def create_gallery_variants(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_variants(instance.image, f'product:{instance.product_id}')
+
+
+@receiver(post_save, sender=Category)
+def create_category_variants(sender, instance, raw=False, **kwargs):
+    if not raw and instance.image:
+        schedule_variants(instance.image, 'category_tree')
+
+
+# Изменение избранного (в том числе из админки) сбрасывает кэш избранного пользователя
+@receiver(post_save, sender=FavoriteProduct)
+@receiver(post_delete, sender=FavoriteProduct)
+def reset_user_favorites(sender, instance, raw=False, **kwargs):
+    if not raw:
+        reset_favorites(instance.user_id)
@@ -0,0 +1,27 @@
+// Подсказки в строке поиска шапки
+const searchInput = document.querySelector('[data-autocomplete-url]')
+const searchSuggest = document.getElementById('search_suggest')
+let suggestTimer = null
+
+if (searchInput && searchSuggest) {
+    searchInput.addEventListener('input', () => {
+        clearTimeout(suggestTimer)
+        const query = searchInput.value.trim()
+        if (query.length < 2) {
+            searchSuggest.innerHTML = ''
+            return
+        }
+        suggestTimer = setTimeout(() => {
+            fetch(`${searchInput.dataset.autocompleteUrl}?q=${encodeURIComponent(query)}`)
+                .then(response => response.json())
+                .then(data => {
+                    searchSuggest.innerHTML = ''
+                    data.results.forEach(item => {
+                        const option = document.createElement('option')
+                        option.value = item.title
+                        searchSuggest.appendChild(option)
+                    })
+                })
+        }, 150)
+    })
+}
@@ -0,0 +1,28 @@
+// Сердечко избранного на карточках: переключается запросом без перезагрузки страницы.
+// Если запрос не удался (гость, нет сети), работает обычная ссылка
+const csrfToken = document.querySelector('meta[name="csrf-token"]')
+
+document.querySelectorAll('[data-favorite-url]').forEach(link => {
+    link.addEventListener('click', event => {
+        if (!csrfToken) {
+            return
+        }
+        event.preventDefault()
+        fetch(link.dataset.favoriteUrl, {
+            method: 'POST',
+            headers: {'X-CSRFToken': csrfToken.content},
+        })
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(response.statusText)
+                }
+                return response.json()
+            })
+            .then(data => {
+                link.querySelector('svg').setAttribute('fill', data.is_favorite ? '#0f2859' : 'none')
+            })
+            .catch(() => {
+                window.location = link.href
+            })
+    })
+})
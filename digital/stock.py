@@ -0,0 +1,97 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .models import Product, OrderProduct
+
+# Резервы товара. Product.quantity - сколько товара на складе, Product.reserved - сколько из него держат корзины.
+# Доступно к покупке quantity - reserved (Product.available), это одна строка товара без подсчёта резервов.
+# Строка корзины держит резерв до OrderProduct.reserved_until (NULL - резерва нет). Истёкшие резервы снимает
+# команда release_expired_holds, при оплате резерв превращается в списание со склада (sell_order).
+# Product.reserved меняется только условными UPDATE вместе со строками корзины в одной транзакции
+
+
+def get_hold_until(ttl=None):
+    return timezone.now() + timedelta(seconds=ttl or settings.STOCK_HOLD_TTL)
+
+
+# Выражение CASE pk WHEN ... THEN <кол-во> END для изменения нескольких товаров одним UPDATE
+def get_quantity_case(quantities):
+    return Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        default=Value(0), output_field=IntegerField()
+    )
+
+
+# Функция резервирует товар, если его хватает. Вернёт False если доступно меньше quantity
+def reserve(product_id, quantity):
+    return bool(Product.objects.filter(pk=product_id, quantity__gte=F('reserved') + quantity).update(
+        reserved=F('reserved') + quantity
+    ))
+
+
+# Функция снимает резервы {product_id: кол-во} одним UPDATE
+def release(quantities):
+    if quantities:
+        Product.objects.filter(pk__in=quantities).update(reserved=F('reserved') - get_quantity_case(quantities))
+
+
+# Функция продлевает резервы заказа перед оплатой. Строки, резерв которых уже снят, резервируются заново.
+# Строки, которых больше нет в наличии, удаляются из корзины. Вернёт False если что-то пришлось удалить
+def hold_order(order, ttl=None):
+    with transaction.atomic():
+        order_products = order.orderproduct_set.filter(product__isnull=False, quantity__gt=0)
+        lines = order_products.select_for_update().values_list('pk', 'product_id', 'quantity', 'reserved_until')
+        missing = [
+            pk for pk, product_id, quantity, reserved_until in lines
+            if reserved_until is None and not reserve(product_id, quantity)
+        ]
+        if missing:
+            OrderProduct.objects.filter(pk__in=missing).delete()
+        order_products.update(reserved_until=get_hold_until(ttl))
+    return not missing
+
+
+# Функция списывает товары оплаченного заказа со склада: quantity уменьшается на всё что куплено,
+# reserved - на то что было зарезервировано. Вызывается один раз, после условного UPDATE заказа (complete_order)
+def sell_order(order_id):
+    order_products = OrderProduct.objects.select_for_update().filter(
+        order_id=order_id, product__isnull=False, quantity__gt=0
+    )
+    sold, held = {}, {}
+    for product_id, quantity, reserved_until in order_products.values_list('product_id', 'quantity', 'reserved_until'):
+        sold[product_id] = quantity
+        if reserved_until is not None:
+            held[product_id] = quantity
+    if sold:
+        Product.objects.filter(pk__in=sold).update(
+            quantity=F('quantity') - get_quantity_case(sold),
+            reserved=F('reserved') - get_quantity_case(held)
+        )
+    OrderProduct.objects.filter(order_id=order_id).update(reserved_until=None)
+
+
+# Функция снимает истёкшие резервы неоплаченных корзин пачками по batch_size строк: на пачку один UPDATE товаров
+# и один UPDATE строк корзины. Товары остаются в корзине, при оформлении заказа они резервируются заново.
+# Вернёт кол-во снятых резервов
+def release_expired_holds(batch_size=None):
+    batch_size = batch_size or settings.STOCK_SWEEP_BATCH_SIZE
+    released = 0
+    while True:
+        with transaction.atomic():
+            holds = list(OrderProduct.objects.select_for_update().filter(
+                Q(order=None) | Q(order__is_completed=False), reserved_until__lt=timezone.now()
+            ).values_list('pk', 'product_id', 'quantity')[:batch_size])
+            quantities = defaultdict(int)
+            for pk, product_id, quantity in holds:
+                if product_id is not None and quantity:
+                    quantities[product_id] += quantity
+            release(quantities)
+            OrderProduct.objects.filter(pk__in=[pk for pk, *_ in holds]).update(reserved_until=None)
+        released += len(holds)
+        if len(holds) < batch_size:
+            return released
@@ -0,0 +1,38 @@
+import gzip
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # Необязательный пакет, без него создаются только .gz
+    brotli = None
+
+
+# Статика с хэшем содержимого в имени файла (style.3f2a1c.css) и сжатыми копиями рядом (.gz, .br),
+# которые nginx отдаёт как есть (gzip_static / brotli_static)
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    compress_extensions = ('.css', '.js', '.svg', '.ttf', '.json', '.txt')
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed_names = {}
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names[name] = hashed_name
+            yield name, hashed_name, processed
+
+        if dry_run:
+            return
+        for hashed_name in hashed_names.values():
+            if hashed_name.endswith(self.compress_extensions):
+                self.compress(hashed_name)
+
+    def compress(self, name):
+        with self.open(name) as file:
+            data = file.read()
+        variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(data, quality=11)))
+        for extension, compressed in variants:
+            if len(compressed) < len(data):  # Маленьким файлам сжатие не помогает
+                with open(self.path(name + extension), 'wb') as file:
+                    file.write(compressed)
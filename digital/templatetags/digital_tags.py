@@ -1,29 +1,28 @@
-from digital.models import Category, Product, FavoriteProduct
+from digital.cache import get_cache_version
+from digital.catalog import get_category_tree, get_variants
+from digital.favorites import get_favorite_ids
 from django import template
+from django.conf import settings
 
 register = template.Library()
 
 
-# Функция для получения категорий на любой странице
+# Функция для получения категорий на любой странице (из кэша, без запросов)
 @register.simple_tag()
 def get_categories():
-    return Category.objects.filter(parent=None)
+    return get_category_tree().roots
 
 
-# Функция для получения цветов меодели
+# Функция для получения цветов меодели: [(color_cod, color_name, slug), ...] из кэша вариантов
 @register.simple_tag()
 def get_colors(model):
-    products = Product.objects.filter(model_product=model)
-    list_colors = [i.color_cod for i in products]
-    print('Список цветов', list_colors)
-    return list_colors
+    return get_variants(model)
 
 
+# Функция для получения id избранных товаров пользователя одним запросом
 @register.simple_tag()
 def get_favorite_products(user):
-    favorite_products = FavoriteProduct.objects.filter(user=user)
-    products = [i.product for i in favorite_products]
-    return products
+    return get_favorite_ids(user)
 
 @register.simple_tag()
 def get_normal_price(price):
@@ -35,3 +34,40 @@ def get_normal_price(price):
 
 
 
+
+
+# Функция возвращает ссылку фильтра: добавляет значение в строку запроса или убирает если оно уже выбрано
+@register.simple_tag(takes_context=True)
+def toggle_filter(context, field, value, multiple=True):
+    params = context['request'].GET.copy()
+    values = params.getlist(field)
+    value = str(value)
+    if value in values:
+        values.remove(value)
+    elif multiple:
+        values.append(value)
+    else:
+        values = [value]
+    params.setlist(field, values)
+    params.pop('page', None)
+    params.pop('cursor', None)  # После смены фильтра показываем первую страницу
+    return f'?{params.urlencode()}'
+
+
+# Функция возвращает ограниченное окно номеров страниц вокруг текущей (1 … 4 5 [6] 7 8 … 40)
+@register.simple_tag()
+def get_page_window(page_obj):
+    return page_obj.paginator.get_elided_page_range(page_obj.number, on_each_side=2, on_ends=1)
+
+
+# Функция возвращает версию данных для ключа кэша фрагмента:
+# {% cache_version 'product' product.pk as version %} {% cache 86400 product_card product.pk version %}
+@register.simple_tag()
+def cache_version(name, pk):
+    return get_cache_version(f'{name}:{pk}')
+
+
+# Собрана ли статика командой build_static (в шаблоне подключается один CSS вместо нескольких)
+@register.simple_tag()
+def use_static_bundle():
+    return settings.STATIC_BUILD
@@ -1,3 +1,1202 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.http import QueryDict
+from django.core.cache import cache
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .assets import build_css_bundle, minify_css
+from .autocomplete import build_snapshot, get_suggestions, has_changes
+from .catalog import get_category_tree, get_new_arrivals, get_variant_slug, get_variants
+from .facets import get_category_facets, rebuild_category_facets
+from .favorites import get_favorite_ids, toggle_favorite
+from .filters import ProductFilter
+from .images import EXTENSION, get_variant_name
+from .models import (Category, Product, Gallery, FavoriteProduct, Brand, CategoryFacet, Order, OrderProduct, City,
+                     PaymentEvent,
+                     ProductDescription, ShippingAddress)
+from .payments import (StripeGateway, complete_order, get_amount, get_idempotency_key, load_gateway,
+                       process_pending_events, set_payment_amount)
+from .pricing import change_prices, set_prices
+from .related import get_related_products
+from .search import search_product_ids, rebuild_index, tokenize
+from .stock import hold_order
+from .storage import CompressedManifestStaticFilesStorage
+from .utils import CartForAuthenticatedUser
+
 
 # Create your tests here.
+
+# Помощник для создания каталога в тестах
+def create_products(category, count, brand=None, start=0, **fields):
+    products = []
+    for i in range(start, start + count):
+        product = Product.objects.create(
+            title=f'Товар {i}', price=1000 * (i + 1), quantity=10, category=category,
+            slug=f'{category.slug}-product-{i}', memory='128', brand=brand, **fields
+        )
+        Gallery.objects.create(product=product, image=f'products/{product.slug}.png')
+        products.append(product)
+    return products
+
+
+# Бюджет запросов для страниц с карточками товаров. Число запросов не должно зависеть от кол-ва карточек
+class CatalogQueryBudgetTest(TestCase):
+    QUERY_BUDGET = {
+        'index': 7,
+        'category_page': 10,
+        'my_favorite': 6,
+    }
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        self.brand = Brand.objects.create(title='Samsung', category=self.category)
+
+    def add_products(self, count):
+        start = Product.objects.count()
+        products = create_products(self.category, count, brand=self.brand, start=start)
+        for product in products:
+            FavoriteProduct.objects.create(user=self.user, product=product)
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_budget(self, name, url):
+        self.client.force_login(self.user)
+        self.add_products(25)
+        small_page = self.count_queries(url)
+        self.add_products(40)
+        big_page = self.count_queries(url)
+
+        self.assertEqual(small_page, big_page, f'{name}: кол-во запросов растёт вместе с кол-вом карточек')
+        self.assertLessEqual(big_page, self.QUERY_BUDGET[name], f'{name}: превышен бюджет запросов')
+
+    def test_index_budget(self):
+        self.assert_budget('index', reverse('index'))
+
+    def test_category_page_budget(self):
+        self.assert_budget('category_page', reverse('category_page', kwargs={'slug': self.category.slug}))
+
+    def test_favorite_page_budget(self):
+        self.assert_budget('my_favorite', reverse('my_favorite'))
+
+    def test_favorite_heart_rendered_from_id_set(self):
+        self.client.force_login(self.user)
+        self.add_products(1)
+        response = self.client.get(reverse('my_favorite'))
+        self.assertContains(response, 'fill="#0f2859"')
+
+
+# Индекс фильтров категории обновляется сигналами и читается одним запросом
+class CategoryFacetTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        self.samsung = Brand.objects.create(title='Samsung', category=self.category)
+        self.apple = Brand.objects.create(title='Apple', category=self.category)
+        create_products(self.category, 2, brand=self.samsung, color_name='Чёрный')
+        create_products(self.category, 1, brand=self.apple, start=2, color_name='Белый')
+
+    def options(self, facets, facet):
+        return {option.value: option.count for option in facets[facet]}
+
+    def test_index_follows_save_and_delete(self):
+        facets = get_category_facets(self.category)
+        self.assertEqual(self.options(facets, CategoryFacet.BRAND), {'Samsung': 2, 'Apple': 1})
+
+        product = Product.objects.get(slug='phones-product-0')
+        product.brand = self.apple
+        product.save()
+        Product.objects.get(slug='phones-product-1').delete()
+
+        facets = get_category_facets(self.category)
+        self.assertEqual(self.options(facets, CategoryFacet.BRAND), {'Apple': 2})
+        self.assertEqual(self.options(facets, CategoryFacet.COLOR), {'Чёрный': 1, 'Белый': 1})
+
+    def test_index_matches_rebuild(self):
+        before = list(CategoryFacet.objects.order_by('facet', 'value').values('facet', 'value', 'count'))
+        rebuild_category_facets()
+        after = list(CategoryFacet.objects.order_by('facet', 'value').values('facet', 'value', 'count'))
+        self.assertEqual(before, after)
+
+    def test_read_is_single_query(self):
+        with self.assertNumQueries(1):
+            get_category_facets(self.category)
+
+    def test_counts_respect_active_filters(self):
+        facets = get_category_facets(self.category, ProductFilter(QueryDict('brand=Samsung')))
+        # Цвета считаются только по товарам Samsung, а бренды - без учёта своего же фильтра
+        self.assertEqual(self.options(facets, CategoryFacet.COLOR), {'Чёрный': 2})
+        self.assertEqual(self.options(facets, CategoryFacet.BRAND), {'Samsung': 2, 'Apple': 1})
+
+    def test_price_range_inside_one_bucket(self):
+        Product.objects.create(title='Товар', price=Decimal('2500000.50'), quantity=1, category=self.category,
+                               slug='phones-expensive', brand=self.samsung, color_name='Чёрный')
+        with CaptureQueriesContext(connection) as queries:
+            facets = get_category_facets(self.category, ProductFilter(QueryDict('brand=Samsung&price_max=1500')))
+        self.assertEqual(self.options(facets, CategoryFacet.COLOR), {'Чёрный': 1})
+        self.assertEqual(self.options(facets, CategoryFacet.BRAND), {'Samsung': 1})
+        self.assertEqual(self.options(facets, CategoryFacet.PRICE), {'0': 2, '2000000': 1})
+        # Группировка по ценовому диапазону, а не по каждой цене
+        grouped = [q['sql'] for q in queries if 'GROUP BY' in q['sql']]
+        self.assertEqual(len(grouped), 1)
+        self.assertIn('FLOOR', grouped[0].upper())
+
+
+# Фильтр категории: несколько брендов и цветов, диапазон цен
+class ProductFilterTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        self.samsung = Brand.objects.create(title='Samsung', category=self.category)
+        self.apple = Brand.objects.create(title='Apple', category=self.category)
+        self.xiaomi = Brand.objects.create(title='Xiaomi', category=self.category)
+        create_products(self.category, 3, brand=self.samsung, color_name='Чёрный')
+        create_products(self.category, 3, brand=self.apple, start=3, color_name='Белый')
+        create_products(self.category, 3, brand=self.xiaomi, start=6, color_name='Синий')
+
+    def filter(self, query):
+        products = ProductFilter(QueryDict(query)).filter(Product.objects.filter(category=self.category))
+        return sorted(products.values_list('price', flat=True))
+
+    def test_multi_value_brand_and_color(self):
+        self.assertEqual(len(self.filter('brand=Samsung&brand=Apple')), 6)
+        self.assertEqual(len(self.filter('brand=Samsung&brand=Apple&color=Белый&color=Синий')), 3)
+
+    def test_price_range(self):
+        self.assertEqual(self.filter('price_min=2000&price_max=4000'), [2000, 3000, 4000])
+        self.assertEqual(self.filter('price_min=8000'), [8000, 9000])
+
+    def test_invalid_values_are_ignored(self):
+        self.assertEqual(len(self.filter('price_min=abc&brand=')), 9)
+
+    def test_filter_is_single_query(self):
+        url = reverse('category_page', kwargs={'slug': self.category.slug})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, {'brand': ['Samsung', 'Apple'], 'price_min': 1000, 'price_max': 5000})
+        product_queries = [q['sql'] for q in queries if 'FROM "digital_product"' in q['sql'] and 'LIMIT' in q['sql']]
+        self.assertEqual(len(product_queries), 1)
+        self.assertIn('"digital_product"."price" >=', product_queries[0])
+
+
+# Постраничный вывод категории по курсору
+@override_settings(CATALOG_PAGE_SIZE=4)
+class CategoryKeysetPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        create_products(self.category, 10)
+        self.url = reverse('category_page', kwargs={'slug': self.category.slug})
+
+    def walk(self, params):
+        pages = []
+        response = self.client.get(self.url, params)
+        while True:
+            page = response.context['page_obj']
+            pages.append([product.pk for product in page])
+            if not page.has_next():
+                return pages, page
+            response = self.client.get(self.url, {**params, 'cursor': page.next_cursor, 'page': page.next_page_number()})
+
+    def test_walk_all_pages(self):
+        pages, last_page = self.walk({'per_page': 4, 'sort': 'price'})
+        prices = [Product.objects.get(pk=pk).price for page in pages for pk in page]
+        self.assertEqual([len(page) for page in pages], [4, 4, 2])
+        self.assertEqual(prices, sorted(prices))
+        self.assertEqual((last_page.number, last_page.paginator.num_pages), (3, 3))
+
+        # Обратно по ссылке "назад"
+        response = self.client.get(self.url, {'sort': 'price', 'cursor': last_page.previous_cursor, 'page': 2})
+        self.assertEqual([product.pk for product in response.context['page_obj']], pages[1])
+
+    def test_deep_page_costs_same_as_first(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as first_page:
+            response = self.client.get(self.url)
+        page = response.context['page_obj']
+        with CaptureQueriesContext(connection) as next_page:
+            self.client.get(self.url, {'cursor': page.next_cursor, 'page': 2})
+        self.assertEqual(len(first_page), len(next_page))
+        self.assertFalse(any('COUNT(' in query['sql'] for query in next_page))
+        self.assertFalse(any('OFFSET' in query['sql'] for query in next_page))
+
+    def test_broken_cursor_shows_first_page(self):
+        response = self.client.get(self.url, {'cursor': 'broken', 'page': 5})
+        self.assertEqual(response.context['page_obj'].number, 1)
+
+    def test_cursor_keeps_microseconds(self):
+        # Товары в одной миллисекунде, разница в несколько микросекунд
+        created_at = timezone.now().replace(microsecond=500_100)
+        for i, product in enumerate(Product.objects.order_by('pk')):
+            Product.objects.filter(pk=product.pk).update(created_at=created_at + timedelta(microseconds=i * 3))
+
+        pages, last_page = self.walk({'per_page': 3})
+        ids = [pk for page in pages for pk in page]
+        self.assertEqual(ids, list(Product.objects.order_by('-created_at', '-pk').values_list('pk', flat=True)))
+
+        response = self.client.get(self.url, {'per_page': 3, 'cursor': last_page.previous_cursor, 'page': 3})
+        self.assertEqual([product.pk for product in response.context['page_obj']], pages[-2])
+
+
+# Похожие товары выбираются без повторов и одним запросом
+class RelatedProductsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        self.products = create_products(self.category, 30)
+
+    def test_sample_is_bounded_and_unique(self):
+        product = self.products[0]
+        related = get_related_products(product, limit=8)
+        pks = [p.pk for p in related]
+        self.assertEqual(len(pks), 8)
+        self.assertEqual(len(set(pks)), 8)
+        self.assertNotIn(product.pk, pks)
+
+    def test_detail_queries_do_not_grow_with_category(self):
+        url = reverse('product_detail', kwargs={'slug': self.products[0].slug})
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as small_category:
+            self.client.get(url)
+        create_products(self.category, 30, start=30)
+        cache.clear()
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as big_category:
+            self.client.get(url)
+        self.assertEqual(len(small_category), len(big_category))
+
+
+# Корзина: склад списывается условным UPDATE и не уходит в минус при одновременных кликах
+class CartStockTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        self.product = create_products(self.category, 1)[0]
+        self.client.force_login(self.user)
+
+    def test_add_and_delete_move_stock(self):
+        self.client.get(reverse('to_cart', kwargs={'pk': self.product.pk, 'action': 'add'}))
+        self.client.get(reverse('to_cart', kwargs={'pk': self.product.pk, 'action': 'add'}))
+        self.product.refresh_from_db()
+        order_product = OrderProduct.objects.get(product=self.product)
+        self.assertEqual((self.product.quantity, self.product.reserved, order_product.quantity), (10, 2, 2))
+        self.assertIsNotNone(order_product.reserved_until)
+
+        self.client.get(reverse('to_cart', kwargs={'pk': self.product.pk, 'action': 'delete'}))
+        self.client.get(reverse('to_cart', kwargs={'pk': self.product.pk, 'action': 'delete'}))
+        self.client.get(reverse('to_cart', kwargs={'pk': self.product.pk, 'action': 'delete'}))
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.product.reserved), (10, 0))
+        self.assertFalse(OrderProduct.objects.exists())
+
+    def test_clear_cart_restocks_in_constant_queries(self):
+        query_counts = []
+        for count in (2, 10):
+            products = create_products(self.category, count, start=len(query_counts) * 100 + 1)
+            for product in products:
+                for _ in range(product.pk % 3 + 1):
+                    self.client.get(reverse('to_cart', kwargs={'pk': product.pk, 'action': 'add'}))
+
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('clear_cart'))
+            query_counts.append(len(queries))
+
+            self.assertFalse(OrderProduct.objects.exists())
+            stock = Product.objects.filter(pk__in=[product.pk for product in products])
+            self.assertEqual(set(stock.values_list('quantity', 'reserved')), {(10, 0)})
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_add_fails_when_out_of_stock(self):
+        Product.objects.filter(pk=self.product.pk).update(quantity=0)
+        response = self.client.get(reverse('to_cart', kwargs={'pk': self.product.pk, 'action': 'add'}), follow=True)
+        self.assertContains(response, 'Товара нет в наличии')
+        self.assertFalse(OrderProduct.objects.filter(quantity__gt=0).exists())
+
+
+# Резервы товара: корзина держит товар до reserved_until, оплата списывает его со склада
+class StockReservationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        self.products = create_products(self.category, 2)
+        self.client.force_login(self.user)
+        for product in self.products:
+            self.client.get(reverse('to_cart', kwargs={'pk': product.pk, 'action': 'add'}))
+        self.client.get(reverse('to_cart', kwargs={'pk': self.products[0].pk, 'action': 'add'}))
+        self.order = Order.objects.get(customer__user=self.user)
+
+    def get_stock(self):
+        return list(Product.objects.order_by('pk').values_list('quantity', 'reserved'))
+
+    def expire_holds(self):
+        OrderProduct.objects.update(reserved_until=timezone.now() - timedelta(seconds=1))
+
+    def test_expired_holds_are_released_in_batches(self):
+        self.assertEqual(self.get_stock(), [(10, 2), (10, 1)])
+        self.expire_holds()
+        out = StringIO()
+        call_command('release_expired_holds', batch_size=1, stdout=out)
+        self.assertIn('Снято резервов: 2', out.getvalue())
+        self.assertEqual(self.get_stock(), [(10, 0), (10, 0)])
+        # Товары остаются в корзине без резерва
+        self.assertEqual(OrderProduct.objects.filter(reserved_until=None).count(), 2)
+
+    def test_paid_order_holds_are_not_released(self):
+        Order.objects.update(is_completed=True)
+        self.expire_holds()
+        call_command('release_expired_holds', stdout=StringIO())
+        self.assertEqual(self.get_stock(), [(10, 2), (10, 1)])
+
+    def test_checkout_holds_released_lines_again(self):
+        self.expire_holds()
+        call_command('release_expired_holds', stdout=StringIO())
+        Product.objects.filter(pk=self.products[1].pk).update(quantity=0)  # Пока резерва не было, товар раскупили
+
+        self.assertFalse(hold_order(self.order))
+        self.assertEqual(self.get_stock(), [(10, 2), (0, 0)])
+        self.assertEqual(list(self.order.orderproduct_set.values_list('product_id', flat=True)), [self.products[0].pk])
+        self.assertTrue(OrderProduct.objects.get().reserved_until > timezone.now())
+
+    def test_payment_converts_holds_to_sold_stock(self):
+        self.assertTrue(complete_order(self.order.pk, 'cs_test_1'))
+        self.assertFalse(complete_order(self.order.pk, 'cs_test_1'))
+        self.assertEqual(self.get_stock(), [(8, 0), (9, 0)])
+        self.assertFalse(OrderProduct.objects.exclude(reserved_until=None).exists())
+
+
+# Снимок подсказок поиска в тестах пишется во временную папку, а не в проект
+TEST_SNAPSHOT = os.path.join(tempfile.gettempdir(), 'digital-test-autocomplete.idx')
+
+
+@override_settings(AUTOCOMPLETE_SNAPSHOT=TEST_SNAPSHOT)
+class CartConcurrencyTest(TransactionTestCase):
+    THREADS = 8
+    CLICKS = 4
+
+    def test_no_oversell_under_contention(self):
+        category = Category.objects.create(title='Смартфоны', slug='phones')
+        product = create_products(category, 1)[0]  # На складе 10 штук
+        users = [User.objects.create_user(username=f'buyer{i}', password='password') for i in range(self.THREADS)]
+        barrier = threading.Barrier(self.THREADS)
+        errors = []
+
+        def click(user):
+            request = RequestFactory().get('/')
+            request.user = user
+            request.session = {}
+            try:
+                barrier.wait()
+                for _ in range(self.CLICKS):
+                    CartForAuthenticatedUser(request, product.pk, 'add')
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=click, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        product.refresh_from_db()
+        in_carts = OrderProduct.objects.aggregate(total=Sum('quantity'))['total']
+        self.assertEqual((product.quantity, product.reserved), (10, 10))
+        self.assertEqual(in_carts, 10)
+
+
+# Сумма корзины считается одним агрегатным запросом
+class CartTotalsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        self.client.force_login(self.user)
+
+    def fill_cart(self, count, start=0):
+        for product in create_products(self.category, count, start=start):
+            self.client.get(reverse('to_cart', kwargs={'pk': product.pk, 'action': 'add'}))
+            self.client.get(reverse('to_cart', kwargs={'pk': product.pk, 'action': 'add'}))
+
+    def test_totals(self):
+        self.fill_cart(3)
+        order = Order.objects.get(customer__user=self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(order.get_cart_total_price, (1000 + 2000 + 3000) * 2)
+            self.assertEqual(order.get_cart_total_quantity, 6)
+
+    def test_empty_cart_totals(self):
+        order = Order.objects.create()
+        self.assertEqual((order.get_cart_total_price, order.get_cart_total_quantity), (0, 0))
+
+    def test_cart_pages_do_not_grow_with_items(self):
+        for url in [reverse('my_cart'), reverse('checkout')]:
+            self.fill_cart(2, start=Product.objects.count())
+            with CaptureQueriesContext(connection) as small_cart:
+                self.client.get(url)
+            self.fill_cart(10, start=Product.objects.count())
+            with CaptureQueriesContext(connection) as big_cart:
+                self.client.get(url)
+            self.assertEqual(len(small_cart), len(big_cart), url)
+
+
+# Корзина гостя в сессии и перенос её в базу при входе
+class SessionCartTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        self.products = create_products(self.category, 2)
+
+    def add(self, product, times=1):
+        for _ in range(times):
+            self.client.get(reverse('to_cart', kwargs={'pk': product.pk, 'action': 'add'}))
+
+    def test_guest_cart_writes_nothing_to_database(self):
+        self.add(self.products[0], 2)
+        self.add(self.products[1])
+        self.assertFalse(OrderProduct.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).quantity, 10)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('my_cart'))
+        self.assertEqual(response.context['order'].get_cart_total_price, 1000 * 2 + 2000)
+        self.assertFalse([q for q in queries if 'digital_product' in q['sql'] or 'digital_order' in q['sql']])
+
+    def test_guest_cannot_add_more_than_stock(self):
+        Product.objects.filter(pk=self.products[0].pk).update(quantity=1)
+        self.add(self.products[0], 3)
+        self.assertEqual(self.client.session['cart'][str(self.products[0].pk)]['quantity'], 1)
+
+    def test_cart_is_merged_on_login(self):
+        self.add(self.products[0], 3)
+        Product.objects.filter(pk=self.products[0].pk).update(quantity=2)  # Пока гость думал, товар раскупили
+        self.client.post(reverse('login'), {'username': 'buyer', 'password': 'password'})
+
+        order_product = OrderProduct.objects.get(order__customer__user=self.user)
+        self.assertEqual((order_product.product_id, order_product.quantity), (self.products[0].pk, 2))
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).available, 0)
+        self.assertEqual(self.client.session['cart'], {})
+
+
+# Покупатель и заказ находятся один раз за запрос, id заказа хранится в сессии
+class BuyerMiddlewareTest(TestCase):
+    QUERY_BUDGET = {
+        'checkout': 8,
+        'payment': 14,  # Вместе с продлением резервов корзины (hold_order), суммой и ценами оплаты заказа
+    }
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        self.client.force_login(self.user)
+        for product in create_products(self.category, 3):
+            self.client.get(reverse('to_cart', kwargs={'pk': product.pk, 'action': 'add'}))
+        self.city = City.objects.create(city_name='Ташкент')
+        self.checkout_data = {
+            'first_name': 'Иван', 'last_name': 'Иванов', 'email': 'buyer@example.com',
+            'city': self.city.pk, 'address': 'Шота Руставели 150', 'region': 'Ташкент', 'phone': '+998712009971',
+        }
+
+    def test_order_id_is_kept_in_session(self):
+        order = Order.objects.get(customer__user=self.user)
+        self.assertEqual(self.client.session['cart_order_id'], order.pk)
+
+    def test_completed_order_is_replaced(self):
+        Order.objects.update(is_completed=True)
+        self.client.get(reverse('my_cart'))
+        self.assertEqual(Order.objects.filter(customer__user=self.user, is_completed=False).count(), 1)
+
+    def test_checkout_query_budget(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('checkout'))
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), self.QUERY_BUDGET['checkout'])
+        self.assertEqual(len([q for q in queries if 'digital_customer' in q['sql']]), 1)
+
+    @mock.patch('stripe.checkout._session_service.SessionService.create_async',
+                return_value=mock.Mock(id='cs_test_1', url='https://checkout.stripe.test/'))
+    def test_payment_query_budget(self, create_session):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('payment'), self.checkout_data)
+        self.assertRedirects(response, 'https://checkout.stripe.test/', 303, fetch_redirect_response=False)
+        self.assertLessEqual(len(queries), self.QUERY_BUDGET['payment'])
+        self.assertEqual(ShippingAddress.objects.get().customer.user, self.user)
+
+    @override_settings(PAYMENT_GATEWAY='digital.payments.FakeGateway', PAYMENT_FAKE_DELAY=1,
+                       PAYMENT_TIMEOUT=0.01, PAYMENT_MAX_RETRIES=0)
+    def test_payment_timeout(self):
+        response = self.client.post(reverse('payment'), self.checkout_data, follow=True)
+        self.assertRedirects(response, reverse('checkout'))
+        self.assertContains(response, 'Платёжная система не отвечает')
+
+    @mock.patch('stripe.checkout._session_service.SessionService.create_async',
+                return_value=mock.Mock(id='cs_test_1', url='https://checkout.stripe.test/'))
+    def test_stripe_gateway_sends_idempotency_key(self, create_session):
+        self.client.post(reverse('payment'), self.checkout_data)
+        params, options = create_session.call_args.args
+        order = Order.objects.get(customer__user=self.user)
+        self.assertEqual(params['metadata'], {'order_id': str(order.pk)})
+        self.assertEqual(params['line_items'][0]['price_data']['unit_amount'], 600_000)  # 6000.00 сум в тийинах
+        self.assertEqual(options['idempotency_key'], get_idempotency_key(order, 600_000))
+
+    @mock.patch('stripe.checkout._session_service.SessionService.create_async',
+                return_value=mock.Mock(id='cs_test_1', url='https://checkout.stripe.test/'))
+    def test_stripe_amount_for_real_prices(self, create_session):
+        # Телефон за 12 499 000 сум и два чехла по 149 500.50 сум
+        Product.objects.filter(slug='phones-product-0').update(price=Decimal('12499000'))
+        Product.objects.filter(slug='phones-product-1').update(price=Decimal('149500.50'))
+        Product.objects.filter(slug='phones-product-2').delete()
+        self.client.get(reverse('to_cart', kwargs={'pk': Product.objects.get(slug='phones-product-1').pk,
+                                                   'action': 'add'}))
+        self.client.post(reverse('payment'), self.checkout_data)
+        price_data = create_session.call_args.args[0]['line_items'][0]['price_data']
+        self.assertEqual(price_data['currency'], 'uzs')
+        self.assertEqual(price_data['unit_amount'], 1_279_800_100)  # 12 798 001.00 сум
+
+    # Под WSGI каждый асинхронный запрос идёт в новом цикле событий, соединения старого цикла не используются
+    def test_stripe_client_per_event_loop(self):
+        gateway = StripeGateway()
+
+        async def get_clients():
+            return gateway.get_client(), gateway.get_client()
+
+        first, same = asyncio.run(get_clients())
+        second, _ = asyncio.run(get_clients())
+        self.assertIs(first, same)
+        self.assertIsNot(first, second)
+        self.assertEqual(len(gateway.clients), 1)  # Клиент закрытого цикла забыт
+
+
+# Дерево категорий в кэше для меню, главной и хлебных крошек
+class CategoryTreeTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.phones = Category.objects.create(title='Телефоны', slug='phones')
+        self.smartphones = Category.objects.create(title='Смартфоны', slug='smartphones', parent=self.phones)
+
+    def test_warm_tree_costs_no_queries(self):
+        get_category_tree()
+        with self.assertNumQueries(0):
+            tree = get_category_tree()
+            self.assertEqual([node.slug for node in tree.roots], ['phones'])
+            self.assertEqual([node.slug for node in tree.roots[0].subcategories], ['smartphones'])
+            self.assertEqual([node.title for node in tree.get_breadcrumbs(self.smartphones.pk)],
+                             ['Телефоны', 'Смартфоны'])
+
+    def test_tree_is_reset_on_save_and_delete(self):
+        get_category_tree()
+        Category.objects.create(title='Телевизоры', slug='tv')
+        self.assertEqual([node.slug for node in get_category_tree().roots], ['phones', 'tv'])
+        self.smartphones.delete()
+        self.assertEqual(get_category_tree().roots[0].subcategories, [])
+
+    def test_header_reads_tree_from_cache(self):
+        self.client.get(reverse('index'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, self.phones.get_absolute_url())
+        self.assertFalse([q for q in queries if 'digital_category' in q['sql']])
+
+
+# Новинки на главной: ограниченный список последних товаров каждой категории
+@override_settings(NEW_ARRIVALS_PER_CATEGORY=2, NEW_ARRIVALS_LIMIT=3)
+class NewArrivalsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.phones = Category.objects.create(title='Телефоны', slug='phones')
+        self.tv = Category.objects.create(title='Телевизоры', slug='tv')
+        self.old_phones = create_products(self.phones, 3)
+        self.tvs = create_products(self.tv, 1, start=3)
+        self.new_phone = create_products(self.phones, 1, start=4)[0]
+
+    def test_top_products_per_category(self):
+        slugs = [product.slug for product in get_new_arrivals()]
+        self.assertEqual(slugs, [self.new_phone.slug, self.tvs[0].slug, self.old_phones[2].slug])
+
+    def test_index_size_is_fixed(self):
+        self.client.get(reverse('index'))
+        with CaptureQueriesContext(connection) as small_catalog:
+            response = self.client.get(reverse('index'))
+        self.assertEqual(len(response.context['products']), 3)
+        create_products(self.tv, 20, start=10)
+        self.client.get(reverse('index'))
+        with CaptureQueriesContext(connection) as big_catalog:
+            response = self.client.get(reverse('index'))
+        self.assertEqual(len(response.context['products']), 3)
+        self.assertEqual(len(small_catalog), len(big_catalog))
+
+
+# Фрагменты каталога кэшируются и сбрасываются при изменении данных
+class FragmentCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        self.brand = Brand.objects.create(title='Samsung', category=self.category)
+        self.product = create_products(self.category, 1, brand=self.brand)[0]
+        ProductDescription.objects.create(product=self.product, parameter='Экран', parameter_info='6.1"')
+        self.category_url = reverse('category_page', kwargs={'slug': self.category.slug})
+        self.detail_url = reverse('product_detail', kwargs={'slug': self.product.slug})
+
+    def test_card_is_reset_on_product_save(self):
+        self.client.get(self.category_url)
+        self.product.title = 'Новое название'
+        self.product.save()
+        self.assertContains(self.client.get(self.category_url), 'Новое название')
+
+    def test_parameters_are_reset_on_description_save(self):
+        self.client.get(self.detail_url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.detail_url)
+        self.assertFalse([q for q in queries if 'digital_productdescription' in q['sql']])
+
+        ProductDescription.objects.create(product=self.product, parameter='Память', parameter_info='256 ГБ')
+        self.assertContains(self.client.get(self.detail_url), '256 ГБ')
+
+    def test_filter_sidebar_is_cached(self):
+        self.client.get(self.category_url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.category_url)
+        self.assertFalse([q for q in queries if 'digital_categoryfacet' in q['sql']])
+
+        self.brand.title = 'Apple'
+        self.brand.save()
+        self.assertContains(self.client.get(self.category_url), 'Apple (1)')
+
+    def test_filter_counts_are_keyed_by_known_values(self):
+        self.client.get(self.category_url, {'brand': ['Samsung', 'Nokia'], 'utm_source': 'mail'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.category_url, {'brand': ['Xiaomi', 'Samsung'], 'utm_source': 'ads'})
+        self.assertFalse([q for q in queries if 'GROUP BY' in q['sql']])
+        self.assertContains(response, 'Samsung (1)')
+        self.assertContains(response, 'utm_source=ads')  # Ссылки фильтров строятся по текущему запросу
+
+    def test_favorite_heart_is_not_cached(self):
+        self.client.get(self.category_url)
+        self.client.force_login(self.user)
+        FavoriteProduct.objects.create(user=self.user, product=self.product)
+        self.assertContains(self.client.get(self.category_url), 'fill="#0f2859"')
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        self.samsung = Brand.objects.create(title='Samsung', category=self.category)
+        self.phone = Product.objects.create(
+            title='Смартфон Galaxy S23 чёрный', price=1000, quantity=10, category=self.category,
+            slug='galaxy-s23', memory='128', brand=self.samsung, model_product='Galaxy S23'
+        )
+        self.case = Product.objects.create(
+            title='Чехол для смартфона', price=100, quantity=10, category=self.category,
+            slug='case', memory='-', model_product='Case'
+        )
+
+    def search(self, query):
+        return search_product_ids(query)[0]
+
+    def test_tokenize_stems_words(self):
+        self.assertEqual(tokenize('Чёрные смартфоны'), ['черн', 'смартфон'])
+        self.assertEqual(tokenize('iPhones charging'), ['iphone', 'charg'])
+
+    def test_search_ranks_title_matches_first(self):
+        ProductDescription.objects.create(product=self.case, parameter='Совместимость', parameter_info='Galaxy S23')
+        self.assertEqual(self.search('galaxy'), [self.phone.pk, self.case.pk])
+        self.assertEqual(set(self.search('смартфоны')), {self.phone.pk, self.case.pk})
+        self.assertEqual(self.search('samsung черный'), [self.phone.pk])
+        self.assertEqual(self.search('чех'), [self.case.pk])  # Поиск по началу слова
+        self.assertEqual(self.search('apple'), [])
+
+    def test_index_is_updated_on_save_and_delete(self):
+        ProductDescription.objects.create(product=self.case, parameter='Материал', parameter_info='Силикон')
+        self.assertEqual(self.search('силиконом'), [self.case.pk])
+
+        self.samsung.title = 'Apple'
+        self.samsung.save()
+        self.assertEqual(self.search('apple'), [self.phone.pk])
+
+        self.phone.delete()
+        self.assertEqual(self.search('galaxy'), [])
+
+    def test_cascade_delete_does_not_reindex(self):
+        ProductDescription.objects.create(product=self.case, parameter='Материал', parameter_info='Силикон')
+        ProductDescription.objects.create(product=self.case, parameter='Цвет', parameter_info='Чёрный')
+        with mock.patch('digital.signals.index_product') as index_product:
+            self.case.delete()
+        index_product.assert_not_called()
+        self.assertEqual(self.search('силикон'), [])
+
+        # Удаление самих характеристик по-прежнему обновляет индекс товара
+        ProductDescription.objects.create(product=self.phone, parameter='Материал', parameter_info='Стекло')
+        self.assertEqual(self.search('стекло'), [self.phone.pk])
+        ProductDescription.objects.filter(product=self.phone).delete()
+        self.assertEqual(self.search('стекло'), [])
+
+    def test_search_without_fts(self):
+        with mock.patch('digital.search.has_fts', return_value=False):
+            rebuild_index()
+            self.assertEqual(self.search('samsung смартфон'), [self.phone.pk])
+            self.assertEqual(self.search('samsung черн'), [self.phone.pk])
+            self.assertEqual(search_product_ids('смартфон', offset=1, limit=1), ([self.case.pk], 2))
+
+    def test_search_page(self):
+        response = self.client.get(reverse('search'), {'q': 'galaxy'})
+        self.assertContains(response, 'Смартфон Galaxy S23')
+        self.assertNotContains(response, 'Чехол для смартфона')
+        self.assertContains(self.client.get(reverse('search'), {'q': 'холодильник'}), 'ничего не найдено')
+
+
+@override_settings(AUTOCOMPLETE_SNAPSHOT=TEST_SNAPSHOT)
+class AutocompleteTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        self.brand = Brand.objects.create(title='Samsung', category=self.category)
+        create_products(self.category, 1, brand=self.brand)
+        Product.objects.filter(slug='phones-product-0').update(title='Samsung Galaxy S23')
+        build_snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(title='Смарт-часы', slug='watches')
+
+    def titles(self, prefix):
+        return [item['title'] for item in get_suggestions(prefix)]
+
+    def test_suggestions_by_word_prefix(self):
+        self.assertEqual(self.titles('смарт'), ['Смартфоны', 'Смарт-часы'])
+        self.assertEqual(self.titles('sam'), ['Samsung', 'Samsung Galaxy S23'])
+        self.assertEqual(self.titles('GAL'), ['Samsung Galaxy S23'])
+        self.assertEqual(self.titles('nokia'), [])
+
+    def test_suggestions_do_not_query_database(self):
+        get_suggestions('sam')
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_suggestions('смарт')), 2)
+
+    # Изменения после коммита попадают в журнал без пересборки снимка и переживают слияние журнала в снимок
+    def test_changes_are_logged_on_commit(self):
+        product = Product.objects.get(slug='phones-product-0')
+        with mock.patch('digital.autocomplete.write_snapshot') as write_snapshot:
+            with self.captureOnCommitCallbacks(execute=True):
+                create_products(self.category, 1, start=1)
+                product.title, product.slug = 'Samsung Galaxy S24', 'galaxy-s24'
+                product.save()
+                Category.objects.get(slug='watches').delete()
+        write_snapshot.assert_not_called()
+        expected = {
+            'товар': ['Товар 1'], 'gal': ['Samsung Galaxy S24'], 'sam': ['Samsung', 'Samsung Galaxy S24'],
+            'смарт': ['Смартфоны'],
+        }
+        for prefix, titles in expected.items():
+            self.assertEqual(self.titles(prefix), titles)
+        self.assertEqual(get_suggestions('gal')[0]['url'], reverse('product_detail', args=['galaxy-s24']))
+
+        build_snapshot()
+        self.assertFalse(has_changes())
+        for prefix, titles in expected.items():
+            self.assertEqual(self.titles(prefix), titles)
+
+    # Ключи товаров "смарт ..." идут по байтам раньше "смартфоны" и не должны вытеснять категорию
+    @override_settings(AUTOCOMPLETE_SCAN_LIMIT=2)
+    def test_products_do_not_hide_categories(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i, title in enumerate(['Смарт Альфа', 'Смарт Бета', 'Смарт Гамма']):
+                Product.objects.create(title=title, price=1000, quantity=1, category=self.category, slug=f'smart-{i}')
+        self.assertEqual(self.titles('смарт')[:2], ['Смартфоны', 'Смарт-часы'])
+
+    def test_products_without_slug_are_skipped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(title='Samsung Galaxy A55', price=1000, quantity=1, category=self.category)
+        self.assertEqual(self.titles('gal'), ['Samsung Galaxy S23'])
+
+    # Транзакция пишет в журнал одну запись, сохранение товара без изменения названия и slug ничего не пишет
+    def test_one_log_write_per_transaction(self):
+        with mock.patch('digital.autocomplete.append_log') as append_log:
+            with self.captureOnCommitCallbacks(execute=True):
+                create_products(self.category, 3, start=1)
+                self.category.delete()
+            append_log.assert_called_once()
+            with self.captureOnCommitCallbacks(execute=True):
+                Category.objects.get(slug='watches').save()
+            append_log.assert_called_once()
+
+    def test_autocomplete_endpoint(self):
+        response = self.client.get(reverse('autocomplete'), {'q': 'gal'})
+        self.assertEqual(response.json()['results'], [
+            {'kind': 'product', 'title': 'Samsung Galaxy S23', 'url': reverse('product_detail', args=['phones-product-0'])}
+        ])
+
+
+class ProductVariantsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        self.black, self.white = create_products(self.category, 2, model_product='Galaxy S23')
+        self.white.color_cod, self.white.color_name = '#ffffff', 'Белый'
+        self.white.save()
+        self.detail_url = reverse('product_detail', kwargs={'slug': self.black.slug})
+
+    def test_variants_are_cached(self):
+        self.assertEqual(get_variants('Galaxy S23'), [
+            ('#000000', 'Чёрный', self.black.slug), ('#ffffff', 'Белый', self.white.slug)
+        ])
+        with self.assertNumQueries(0):
+            get_variants('Galaxy S23')
+
+        self.white.model_product = 'Galaxy S24'
+        self.white.save()
+        self.assertEqual([variant.slug for variant in get_variants('Galaxy S23')], [self.black.slug])
+        self.assertEqual([variant.slug for variant in get_variants('Galaxy S24')], [self.white.slug])
+
+    def test_detail_page_links_variants(self):
+        self.client.get(self.detail_url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.detail_url)
+        self.assertContains(response, reverse('product_detail', kwargs={'slug': self.white.slug}))
+        self.assertFalse([q for q in queries if '"model_product" =' in q['sql']])
+
+    def test_color_url_redirects_to_variant(self):
+        url = reverse('product_color', args=['Galaxy S23', '#ffffff'])
+        response = self.client.get(url)
+        self.assertRedirects(response, reverse('product_detail', kwargs={'slug': self.white.slug}), 301)
+        self.assertEqual(self.client.get(reverse('product_color', args=['Galaxy S23', '#ff0000'])).status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_variant_slug('Galaxy S23', '#000000'), self.black.slug)
+
+
+def create_image_file(name, size=(1200, 800)):
+    from PIL import Image
+    buffer = BytesIO()
+    Image.new('RGB', size, '#0f2859').save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class ImageVariantsTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root, IMAGE_VARIANTS_ASYNC=False))
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        self.product = Product.objects.create(
+            title='Товар', price=1000, quantity=10, category=self.category, slug='product', memory='128'
+        )
+
+    def test_variants_are_created_on_upload(self):
+        from PIL import Image
+        gallery = Gallery.objects.create(product=self.product, image=create_image_file('phone.png'))
+        for size, side in [('thumb', 150), ('card', 400), ('detail', 1000)]:
+            with Image.open(os.path.join(self.media_root, get_variant_name(gallery.image.name, size))) as image:
+                self.assertEqual(max(image.size), side)
+
+        self.assertEqual(self.product.get_image_product(), f'/media/products/phone.card.{EXTENSION}')
+        self.assertIn(f'/media/products/phone.thumb.{EXTENSION} 150w', self.product.get_image_srcset())
+
+    def test_original_is_used_without_variants(self):
+        Gallery.objects.create(product=self.product, image='products/missing.png')
+        self.assertEqual(self.product.get_image_product(), '/media/products/missing.png')
+        self.assertEqual(self.product.get_image_srcset(), '')
+
+    def test_backfill_command(self):
+        with override_settings(IMAGE_VARIANTS_ASYNC=True):  # Копии не создаются: on_commit в тесте не вызывается
+            gallery = Gallery.objects.create(product=self.product, image=create_image_file('phone.png'))
+        self.assertEqual(self.product.get_image_srcset(), '')
+
+        call_command('build_image_variants', stdout=StringIO())
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, get_variant_name(gallery.image.name, 'card'))))
+
+
+class StaticBuildTest(TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+
+    def test_minify_css(self):
+        css = '/* шапка */\n.nav  > a ,\n.logo {\n  color : #fff;\n  margin: 0 auto;\n}\n'
+        self.assertEqual(minify_css(css), '.nav>a,.logo{color:#fff;margin:0 auto}')
+
+    def test_css_bundle_inlines_imports(self):
+        from pathlib import Path
+        with open(build_css_bundle(Path(self.output_dir)), encoding='utf-8') as file:
+            css = file.read()
+        self.assertNotIn('@import', css)
+        self.assertTrue(css.startswith('@font-face'))  # Шрифты из fonts.css идут первыми
+        self.assertIn('url(../fonts/MontserratAlternates-Regular.ttf)', css)
+        self.assertIn('swiper-container{', css)
+
+    def test_storage_writes_compressed_copies(self):
+        storage = CompressedManifestStaticFilesStorage(location=self.output_dir)
+        name = storage.save('digital/site.css', SimpleUploadedFile('site.css', b'.card{color:#fff}' * 100))
+        storage.compress(name)
+        with gzip.open(os.path.join(self.output_dir, name + '.gz')) as file:
+            self.assertEqual(file.read(), b'.card{color:#fff}' * 100)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class PaymentWebhookTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        self.client.force_login(self.user)
+        self.products = create_products(self.category, 2)
+        self.client.get(reverse('to_cart', kwargs={'pk': self.products[0].pk, 'action': 'add'}))
+        self.order = Order.objects.get(customer__user=self.user)
+        set_payment_amount(self.order, get_amount(self.order.get_cart_total_price))
+
+    def get_event(self, event_id='evt_1', order_id=None):
+        return {
+            'id': event_id,
+            'type': 'checkout.session.completed',
+            'data': {'object': {
+                'id': 'cs_test_1', 'payment_status': 'paid', 'metadata': {'order_id': str(order_id or self.order.pk)},
+                'amount_total': self.order.payment_amount, 'currency': self.order.payment_currency,
+            }},
+        }
+
+    def send(self, event, secret='whsec_test'):
+        payload = json.dumps(event)
+        timestamp = int(time.time())
+        signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('payment_webhook'), payload, content_type='application/json',
+                                    HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}')
+
+    def test_completed_session_finishes_order(self):
+        self.assertEqual(self.send(self.get_event()).status_code, 200)
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.is_completed)
+        self.assertEqual(self.order.payment_id, 'cs_test_1')
+        self.assertEqual(self.order.orderproduct_set.count(), 1)  # Товары остаются в истории заказа
+
+        # Новый запрос получает новую пустую корзину
+        self.client.get(reverse('my_cart'))
+        self.assertEqual(Order.objects.filter(customer__user=self.user, is_completed=False).count(), 1)
+
+    def test_replayed_event_is_ignored(self):
+        self.send(self.get_event())
+        paid_at = Order.objects.get(pk=self.order.pk).paid_at
+        self.assertEqual(self.send(self.get_event()).status_code, 200)
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).paid_at, paid_at)
+
+    def test_bad_signature_is_rejected(self):
+        self.assertEqual(self.send(self.get_event(), secret='whsec_other').status_code, 400)
+        self.assertFalse(PaymentEvent.objects.exists())
+        self.assertFalse(Order.objects.get(pk=self.order.pk).is_completed)
+
+    def test_failed_event_stays_in_queue(self):
+        event = self.get_event()
+        del event['data']['object']['metadata']
+        self.send(event)
+        payment_event = PaymentEvent.objects.get()
+        self.assertIsNone(payment_event.processed_at)
+        self.assertIn('KeyError', payment_event.error)
+
+        PaymentEvent.objects.update(payload=self.get_event())
+        self.assertEqual(process_pending_events(), 1)
+        self.assertTrue(Order.objects.get(pk=self.order.pk).is_completed)
+
+    def test_cart_changed_after_checkout_is_not_completed(self):
+        event = self.get_event()
+        self.client.get(reverse('to_cart', kwargs={'pk': self.products[1].pk, 'action': 'add'}))
+        self.send(event)
+        payment_event = PaymentEvent.objects.get()
+        self.assertIsNone(payment_event.processed_at)
+        self.assertIn('Корзина заказа изменилась', payment_event.error)
+        self.assertFalse(Order.objects.get(pk=self.order.pk).is_completed)
+
+    def test_price_change_after_checkout_still_completes(self):
+        Product.objects.filter(pk=self.products[0].pk).update(price=Decimal('999999'))
+        self.send(self.get_event())
+        self.assertTrue(Order.objects.get(pk=self.order.pk).is_completed)
+
+    def test_paid_amount_must_match_order(self):
+        event = self.get_event()
+        event['data']['object']['amount_total'] += 100
+        self.send(event)
+        self.assertIn('PaymentError', PaymentEvent.objects.get().error)
+        self.assertFalse(Order.objects.get(pk=self.order.pk).is_completed)
+
+    def test_success_page_does_not_write(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('success')).status_code, 200)
+        writes = [q for q in queries if q['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(writes, [])
+        self.assertEqual(self.order.orderproduct_set.count(), 1)
+
+    @override_settings(PAYMENT_GATEWAY='digital.payments.FakeGateway')
+    def test_fake_gateway_completes_order(self):
+        load_gateway.cache_clear()  # Новый FakeGateway без сессий прошлых тестов
+        data = {'first_name': 'Иван', 'last_name': 'Иванов', 'email': 'buyer@example.com'}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('payment'), data)
+        self.assertEqual(response.status_code, 303)
+        self.assertTrue(response.url.startswith('http://testserver/success_payment/?session_id=cs_fake_'))
+        self.assertTrue(Order.objects.get(pk=self.order.pk).is_completed)
+
+        # Повторная отправка формы возвращает ту же сессию оплаты и не создаёт новое событие
+        Order.objects.filter(pk=self.order.pk).update(is_completed=False)
+        self.assertEqual(self.client.post(reverse('payment'), data).url, response.url)
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+
+
+class FavoriteProductTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        self.product = create_products(self.category, 1)[0]
+        self.client.force_login(self.user)
+
+    def toggle(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return toggle_favorite(self.user, self.product.pk)
+
+    def test_toggle_adds_and_removes(self):
+        self.assertTrue(self.toggle())
+        self.assertEqual(get_favorite_ids(self.user), {self.product.pk})
+        self.assertFalse(self.toggle())
+        self.assertEqual(get_favorite_ids(self.user), set())
+
+    def test_duplicate_favorite_is_rejected(self):
+        FavoriteProduct.objects.create(user=self.user, product=self.product)
+        with self.assertRaises(IntegrityError):
+            FavoriteProduct.objects.create(user=self.user, product=self.product)
+
+    def test_favorite_ids_are_cached(self):
+        self.toggle()
+        get_favorite_ids(self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_favorite_ids(self.user), {self.product.pk})
+
+        # Изменение из админки тоже сбрасывает кэш
+        with self.captureOnCommitCallbacks(execute=True):
+            FavoriteProduct.objects.filter(user=self.user).first().delete()
+        self.assertEqual(get_favorite_ids(self.user), set())
+
+    def test_toggle_json(self):
+        url = reverse('toggle_favorite', args=[self.product.slug])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
+        self.assertEqual(response.json(), {'product_id': self.product.pk, 'is_favorite': True})
+        self.assertContains(self.client.get(reverse('my_favorite')), self.product.title)
+
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.client.logout()
+        self.assertEqual(self.client.post(url).status_code, 401)
+
+    def test_toggle_redirects_back(self):
+        response = self.client.get(reverse('add_favorite', args=[self.product.slug]), HTTP_REFERER='/')
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        self.assertTrue(FavoriteProduct.objects.filter(user=self.user, product=self.product).exists())
+        self.assertEqual(self.client.get(reverse('add_favorite', args=['missing'])).status_code, 404)
+
+    @override_settings(CATALOG_PAGE_SIZE=2)
+    def test_favorites_page_is_ordered_by_added_time(self):
+        products = [self.product, *create_products(self.category, 2, start=1)]
+        for minutes, product in enumerate(products):
+            favorite = FavoriteProduct.objects.create(user=self.user, product=product)
+            FavoriteProduct.objects.filter(pk=favorite.pk).update(added_at=favorite.added_at.replace(minute=minutes))
+
+        get_favorite_ids(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('my_favorite'))
+        self.assertEqual(list(response.context['products']), products[:0:-1])
+        self.assertEqual(response.context['paginator'].num_pages, 2)
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql']])
+
+        cursor = response.context['page_obj'].next_cursor
+        response = self.client.get(reverse('my_favorite'), {'cursor': cursor, 'page': 2})
+        self.assertEqual(list(response.context['products']), products[:1])
+
+    @override_settings(CATALOG_PAGE_SIZE=2)
+    def test_favorites_in_same_millisecond_are_not_lost(self):
+        products = [self.product, *create_products(self.category, 4, start=1)]
+        added_at = timezone.now().replace(microsecond=250_000)
+        for i, product in enumerate(products):
+            favorite = FavoriteProduct.objects.create(user=self.user, product=product)
+            FavoriteProduct.objects.filter(pk=favorite.pk).update(added_at=added_at + timedelta(microseconds=i))
+
+        seen = []
+        response = self.client.get(reverse('my_favorite'))
+        while True:
+            page = response.context['page_obj']
+            seen += [product.pk for product in page]
+            if not page.has_next():
+                break
+            response = self.client.get(reverse('my_favorite'), {'cursor': page.next_cursor, 'page': page.number + 1})
+        self.assertEqual(seen, [product.pk for product in reversed(products)])
+
+
+class ExplainQueriesTest(TestCase):
+    def test_pages_have_no_full_table_scans(self):
+        category = Category.objects.create(title='Смартфоны', slug='phones')
+        brand = Brand.objects.create(title='Samsung', category=category)
+        create_products(category, 3, brand=brand, model_product='Galaxy S23')
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        self.assertIn('Полных проходов по таблицам: 0', out.getvalue(), out.getvalue())
+        self.assertFalse(User.objects.filter(username='explain_queries_user').exists())
+
+
+class PricingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(title='Смартфоны', slug='phones')
+        self.products = create_products(self.category, 3)  # 1000, 2000, 3000
+        rebuild_category_facets()
+
+    def get_prices(self):
+        return list(Product.objects.order_by('pk').values_list('price', flat=True))
+
+    def test_cart_totals_are_exact(self):
+        Product.objects.filter(pk=self.products[0].pk).update(price=Decimal('0.10'))
+        Product.objects.filter(pk=self.products[1].pk).update(price=Decimal('0.20'))
+        user = User.objects.create_user(username='buyer', password='password')
+        self.client.force_login(user)
+        for product in self.products[:2]:
+            self.client.get(reverse('to_cart', kwargs={'pk': product.pk, 'action': 'add'}))
+        cart = self.client.get(reverse('my_cart')).context
+        self.assertEqual(cart['order'].get_cart_total_price, Decimal('0.30'))
+        self.assertEqual([item.get_total_price for item in cart['products']], [Decimal('0.10'), Decimal('0.20')])
+
+    def test_get_amount_uses_minor_units(self):
+        self.assertEqual(get_amount(Decimal('19.99')), 1999)
+        self.assertEqual(get_amount(0.1 + 0.2), 30)
+        self.assertEqual(get_amount(Decimal('12499000')), 1_249_900_000)  # Сум -> тийины
+        with override_settings(PAYMENT_CURRENCY='jpy'):
+            self.assertEqual(get_amount(Decimal('1500')), 1500)
+
+    def test_change_prices_in_one_update(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(change_prices(Product.objects.filter(price__gte=2000), -12.5), 2)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE "digital_product"')]), 1)
+        self.assertEqual(self.get_prices(), [Decimal('1000.00'), Decimal('1750.00'), Decimal('2625.00')])
+        # Фильтр по цене пересобран
+        prices = CategoryFacet.objects.filter(category=self.category, facet=CategoryFacet.PRICE)
+        self.assertEqual(sum(prices.values_list('count', flat=True)), 3)
+
+    def test_set_prices(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            set_prices({self.products[0].pk: '999.999', self.products[2].pk: 5})
+        self.assertEqual(self.get_prices(), [Decimal('1000.00'), Decimal('2000.00'), Decimal('5.00')])
@@ -10,11 +10,15 @@ urlpatterns = [
     path('product_detail/<slug:slug>/', ProductDetail.as_view(), name='product_detail'),
     path('product_color/<str:model_product>/<str:color>/', product_by_color, name='product_color'),
     path('add_favorite/<slug:slug>/', save_favorite_product, name='add_favorite'),
+    path('api/favorite/<slug:slug>/', toggle_favorite_view, name='toggle_favorite'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('autocomplete/', autocomplete_view, name='autocomplete'),
     path('my_favorite/', FavoriteProductsView.as_view(), name='my_favorite'),
     path('to_cart/<int:pk>/<str:action>/', to_cart_view, name='to_cart'),
     path('my_cart/', my_cart_view, name='my_cart'),
     path('checkout/', checkout, name='checkout'),
     path('payment/', create_checkout_session, name='payment'),
     path('success_payment/', success_payment, name='success'),
+    path('payment/webhook/', payment_webhook, name='payment_webhook'),
     path('clear_cart/', clear_cart, name='clear_cart')
 ]
\ No newline at end of file
@@ -1,22 +1,52 @@
-from .models import Product, OrderProduct, Order, Customer
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import ExpressionWrapper, F
+from django.utils import timezone
+
+from .favorites import get_favorite_ids
+from .middleware import get_buyer
+from .models import PRICE_FIELD, Product, OrderProduct
+from .stock import get_hold_until, release, reserve
+
+
+# Функция подготавливает товары для карточек: бренд и картинки галереи грузятся одним запросом на всю страницу
+def get_card_products(products):
+    return products.select_related('brand').prefetch_related('images')
+
+
+# Миксин для вьюшек с карточками товаров, отдаёт в шаблон id избранных товаров
+class ProductCardsMixin:
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['favorite_ids'] = get_favorite_ids(self.request.user)
+        return context
+
 
 # В данном классе будит метод для получния инфо о товарах и метод добаления и удаления
 class CartForAuthenticatedUser:
     def __init__(self, request, product_id=None, action=None):
         self.user = request.user
+        self.buyer = get_buyer(request)
+        self.updated = False
 
         # Если в product_id и action что то попало то метод запуститься
         if product_id and action:
-            self.add_or_delete(product_id, action)
+            self.updated = self.add_or_delete(product_id, action)
 
+    # Метод для получения заказа пользователя без подсчёта суммы (один раз за запрос)
+    def get_order(self):
+        return self.buyer.order
 
     # Метод для получения инфо о корзине
     def get_cart_info(self):
-        customer, created = Customer.objects.get_or_create(user=self.user)  # Получ или создадим покупателя
-
-        order, created = Order.objects.get_or_create(customer=customer)
-        print( 'Пользователь', order)
-        order_products = order.orderproduct_set.all()
+        order = self.get_order()
+        # Товары корзины вместе с продуктом и его картинками, без запроса на каждую строку.
+        # Сумма строки (цена * кол-во) считается в том же запросе
+        order_products = order.orderproduct_set.select_related('product').prefetch_related('product__images').annotate(
+            total_price=ExpressionWrapper(F('product__price') * F('quantity'), output_field=PRICE_FIELD)
+        )
 
         cart_total_quantity = order.get_cart_total_quantity
         cart_total_price = order.get_cart_total_price
@@ -28,42 +58,195 @@ class CartForAuthenticatedUser:
             'products': order_products
         }
 
-    # Метод дял добавления товара в корзину или удаления
+    # Метод добавляет товар в корзину и резервирует его на STOCK_HOLD_TTL (см. stock.py).
+    # Резерв ставится условным UPDATE в транзакции, поэтому одновременные клики не зарезервируют лишнего.
+    # Если резерв строки уже истёк и снят, строка резервируется заново целиком.
+    # Вернёт False если доступно меньше нужного кол-ва
+    def add(self, product_id, quantity=1, order=None):
+        order = order or self.get_order()
+
+        with transaction.atomic():
+            order_product, created = OrderProduct.objects.select_for_update().get_or_create(
+                order=order, product_id=product_id
+            )
+            released = (order_product.quantity or 0) if order_product.reserved_until is None else 0
+            if not reserve(product_id, quantity + released):
+                if created:
+                    order_product.delete()
+                return False
+            # В корзину прибавилось, резерв продлён
+            OrderProduct.objects.filter(pk=order_product.pk).update(
+                quantity=F('quantity') + quantity, reserved_until=get_hold_until()
+            )
+            return True
+
+    # Метод дял добавления товара в корзину или удаления.
+    # Вернёт False если товара нет в наличии или его нет в корзине
     def add_or_delete(self, product_id, action):
-        order = self.get_cart_info()['order']
-        product = Product.objects.get(pk=product_id)
-        order_product, created = OrderProduct.objects.get_or_create(order=order, product=product)
+        if action == 'add':
+            return self.add(product_id)
+
+        order = self.get_order()
+        with transaction.atomic():
+            order_product = OrderProduct.objects.select_for_update().filter(order=order, product_id=product_id).first()
+            if order_product is None:
+                return False
+
+            if order_product.quantity <= 1:
+                order_product.delete()
+            else:
+                OrderProduct.objects.filter(pk=order_product.pk).update(quantity=F('quantity') - 1)  # В корзину убавилось -1
+            if order_product.quantity > 0 and order_product.reserved_until is not None:
+                release({product_id: 1})  # Из резерва товара -1
+            return True
+
+    # Метод очищает корзину одним DELETE, резервы корзины снимаются одним UPDATE:
+    # reserved = reserved - CASE id WHEN ... THEN <кол-во в корзине> END. Кол-во запросов не зависит от размера корзины
+    def clear(self):
+        order = self.get_order()
+        order_products = OrderProduct.objects.filter(order=order)
 
-        if action == 'add' and product.quantity > 0:
-            order_product.quantity += 1  # В корзину прибавилось +1
-            product.quantity -= 1 # У продукта на складе его кол-вщ убавилось -1
-        else:
-            order_product.quantity -= 1  # В корзину убавилось -1
-            product.quantity += 1  # У продукта на складе его кол-во прибавилось +1
+        with transaction.atomic():
+            # В заказе одна строка на товар (unique_order_product), поэтому словарь не теряет строк
+            release(dict(order_products.select_for_update().filter(
+                product__isnull=False, quantity__gt=0, reserved_until__isnull=False
+            ).values_list('product_id', 'quantity')))
+            order_products.delete()
+
+
+
+
+
+# Товар корзины гостя. Повторяет поля Product которые нужны шаблонам корзины
+class SessionCartProduct:
+    def __init__(self, pk, data):
+        self.pk = pk
+        self.title = data['title']
+        self.price = Decimal(str(data['price']))
+        self.color_name = data['color_name']
+        self.quantity = data['stock']  # Доступный остаток на момент добавления
+        self.available = data['stock']
+        self.image = data['image']
+
+    def get_image_product(self):
+        return self.image
+
+    def get_image_srcset(self):
+        return ''
+
+
+# Строка корзины гостя, повторяет OrderProduct
+class SessionCartItem:
+    def __init__(self, pk, data):
+        self.product = SessionCartProduct(pk, data)
+        self.quantity = data['quantity']
+        self.added_at = datetime.fromisoformat(data['added_at'])
 
-        product.save()
-        order_product.save()
+    @property
+    def get_total_price(self):
+        return self.product.price * self.quantity
 
-        if order_product.quantity <= 0:
-            order_product.delete()
 
+# Итоги корзины гостя, повторяют свойства Order
+class SessionOrder:
+    def __init__(self, items):
+        self.get_cart_total_price = sum(item.get_total_price for item in items)
+        self.get_cart_total_quantity = sum(item.quantity for item in items)
 
 
-    # Метод который будит очищать корзину после заказа
+# Корзина для гостей. Хранится в сессии и ничего не пишет в базу,
+# товары переносятся в корзину в базе при входе в аккаунт (merge_session_cart)
+class CartForAnonymousUser:
+    session_key = 'cart'
+
+    def __init__(self, request, product_id=None, action=None):
+        self.session = request.session
+        self.updated = False
+
+        if product_id and action:
+            self.updated = self.add_or_delete(product_id, action)
+
+    @property
+    def items(self):
+        return self.session.get(self.session_key, {})
+
+    def save(self, items):
+        self.session[self.session_key] = items
+        self.session.modified = True
+
+    def get_cart_info(self):
+        items = [SessionCartItem(int(pk), data) for pk, data in self.items.items()]
+        order = SessionOrder(items)
+        return {
+            'cart_total_quantity': order.get_cart_total_quantity,
+            'cart_total_price': order.get_cart_total_price,
+            'order': order,
+            'products': items
+        }
+
+    # Гость только читает доступный остаток, резерв будет при переносе корзины в базу
+    def add_or_delete(self, product_id, action):
+        items = self.items
+        key = str(product_id)
+
+        if action == 'add':
+            product = Product.objects.prefetch_related('images').filter(pk=product_id).first()
+            quantity = items.get(key, {}).get('quantity', 0)
+            if product is None or product.available <= quantity:
+                return False
+            items[key] = {
+                'quantity': quantity + 1,
+                'title': product.title,
+                'price': str(product.price),  # Decimal в сессии (JSON) хранится строкой
+                'color_name': product.color_name,
+                'stock': product.available,
+                'image': product.get_image_product(),
+                'added_at': items.get(key, {}).get('added_at', timezone.now().isoformat()),
+            }
+        elif key in items:
+            items[key]['quantity'] -= 1
+            if items[key]['quantity'] <= 0:
+                del items[key]
+        else:
+            return False
+
+        self.save(items)
+        return True
+
+    # Гость ничего не резервировал, поэтому снимать нечего
     def clear(self):
-        order = self.get_cart_info()['order']
-        order_products = order.orderproduct_set.all()
-        for product in order_products:
-            product.delete()
-        order.save()
+        self.save({})
+
+
+# Функция возвращает корзину в базе для пользователя или корзину в сессии для гостя
+def get_cart(request, product_id=None, action=None):
+    if request.user.is_authenticated:
+        return CartForAuthenticatedUser(request, product_id, action)
+    return CartForAnonymousUser(request, product_id, action)
+
 
+# Функция переносит корзину гостя в корзину пользователя после входа в аккаунт.
+# Переносится столько, сколько ещё доступно
+def merge_session_cart(request):
+    session_cart = CartForAnonymousUser(request)
+    items = session_cart.items
+    if not items:
+        return
 
+    user_cart = CartForAuthenticatedUser(request)
+    order = user_cart.get_order()
+    stock = dict(Product.objects.filter(pk__in=items.keys()).values_list('pk', F('quantity') - F('reserved')))
+    for pk, data in items.items():
+        quantity = min(data['quantity'], stock.get(int(pk), 0))
+        if quantity > 0:
+            user_cart.add(int(pk), quantity, order=order)
 
+    session_cart.clear()
 
 
 # Функция которая будит возвращать инфо о корзине при помощи метода класса
 def get_cart_data(request):
-    cart = CartForAuthenticatedUser(request)
+    cart = get_cart(request)
     cart_info = cart.get_cart_info()
     return cart_info
 
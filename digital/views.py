@@ -1,5 +1,10 @@
-from random import randint
+import asyncio
+import json
 
+import stripe
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render, redirect
 from .models import *
 from django.views.generic import ListView, DetailView
@@ -7,16 +12,29 @@ from .forms import LoginForm, RegisterForm, CustomerForm, ShippingForm
 from django.contrib.auth import login, logout
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
-from .utils import CartForAuthenticatedUser, get_cart_data
-import stripe
-from shop import settings
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.db.models import F
+from .autocomplete import get_suggestions
+from .catalog import get_category_tree, get_new_arrivals, get_variant_slug
+from .facets import LazyCategoryFacets
+from .favorites import get_favorite_ids, toggle_favorite
+from .filters import ProductFilter, parse_int
+from .payments import PaymentError, get_amount, get_gateway, receive_event, set_payment_amount
+from .pagination import KeysetPaginator, SORTS
+from .related import get_related_products
+from .search import SearchResults
+from .stock import hold_order
+from .utils import (CartForAuthenticatedUser, get_cart, get_cart_data, merge_session_cart, ProductCardsMixin,
+                    get_card_products)
+from django.conf import settings
 
 
 # Create your views here.
 
-class ProductList(ListView):
+class ProductList(ProductCardsMixin, ListView):
     model = Product
-    context_object_name = 'categories'
+    context_object_name = 'products'
 
     extra_context = {
         'title': 'DigitalStore'
@@ -24,54 +42,46 @@ class ProductList(ListView):
 
     template_name = 'digital/index.html'
 
+    # Новинки: ограниченный список последних товаров, id берутся из кэша
     def get_queryset(self):
-        categories = Category.objects.filter(parent=None)
-        return categories
+        return get_new_arrivals()
 
 
-class CategoryView(ListView):
+class CategoryView(ProductCardsMixin, ListView):
     model = Product
     context_object_name = 'products'
     template_name = 'digital/category_page.html'
-    paginate_by = 1
-
-    def get_queryset(self):
-        brand_field = self.request.GET.get('brand')
-        color_field = self.request.GET.get('color')
-        price_field = self.request.GET.get('price')
-        discount_field = self.request.GET.get('discount')
-
-        category = Category.objects.get(slug=self.kwargs['slug'])
-        products = Product.objects.filter(category=category)
-
-        if brand_field:
-            products = products.filter(brand__title=brand_field)
 
-        if color_field:
-            products = products.filter(color_name=color_field)
+    def get_paginate_by(self, queryset):
+        per_page = parse_int(self.request.GET.get('per_page')) or settings.CATALOG_PAGE_SIZE
+        return min(max(per_page, 1), settings.CATALOG_MAX_PAGE_SIZE)
 
-        if price_field:
-            products = products.filter(price=price_field)
+    # Постраничный вывод по курсору: глубокие страницы стоят столько же сколько первая
+    def paginate_queryset(self, queryset, page_size):
+        ordering = SORTS.get(self.request.GET.get('sort'), SORTS['new'])
+        paginator = KeysetPaginator(queryset, page_size, ordering)
+        page = paginator.page(self.request.GET.get('cursor'), parse_int(self.request.GET.get('page')) or 1)
+        return paginator, page, page.object_list, page.has_other_pages()
 
-        if discount_field:
-            products = products.filter(discount=discount_field)
+    def get_queryset(self):
+        tree = get_category_tree()
+        self.category = tree.by_slug.get(self.kwargs['slug'])  # Категория из кэша, без запроса
+        if self.category is None:
+            raise Http404('Категория не найдена')
+        self.breadcrumbs = tree.get_breadcrumbs(self.category.pk)
+        self.product_filter = ProductFilter(self.request.GET)  # Фильтры бренда, цвета, цены и скидки из строки запроса
 
-        return products
+        products = self.product_filter.filter(Product.objects.filter(category_id=self.category.pk))
+        return get_card_products(products)
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data()
-        category = Category.objects.get(slug=self.kwargs['slug'])
-        products = Product.objects.filter(category=category)
-        brands = list(set([i.brand for i in products]))
-        colors = list(set([i.color_name for i in products]))
-        prices = list(set([int(i.price) for i in products]))
-        discounts = list(set([i.discount for i in products]))
-
-        context['brands'] = brands
-        context['colors'] = colors
-        context['prices'] = prices
-        context['discounts'] = discounts
+        category = self.category
+
+        context['facets'] = LazyCategoryFacets(category, self.product_filter)  # Берутся из кэша при обращении в шаблоне
+        context['product_filter'] = self.product_filter
         context['category'] = category
+        context['breadcrumbs'] = self.breadcrumbs
         context['title'] = f'Категория: {category.title}'
 
         return context
@@ -89,6 +99,7 @@ def user_login(request):
                 user = form.get_user()
                 if user:
                     login(request, user)
+                    merge_session_cart(request)  # Товары из корзины гостя переносим в корзину пользователя
                     messages.success(request, 'Вы вошли в аккаунт')
                     return redirect('index')
                 else:
@@ -143,62 +154,45 @@ def register_view(request):
 
 
 # Вьюшка для детали товара
-class ProductDetail(DetailView):
+class ProductDetail(ProductCardsMixin, DetailView):
     model = Product
     context_object_name = 'product'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data()
-        product = Product.objects.get(slug=self.kwargs['slug'])
+        product = self.object
         context['title'] = f'Товар {product.title}'
-
-        products = Product.objects.filter(category=product.category)  # Получ список продуктов категории
-        data = []
-        for i in range(len(products)):
-            random_index = randint(0, len(products) - 1)
-            p = products[random_index]
-            if p not in data and product != p:
-                data.append(p)
-            context['products'] = data
+        context['breadcrumbs'] = get_category_tree().get_breadcrumbs(product.category_id)
+        context['products'] = get_related_products(product)  # Похожие товары из той же категории
 
         return context
 
 
+# Старые ссылки на цвет модели ведут на страницу товара нужного цвета (slug берётся из словаря цветов в кэше)
 def product_by_color(request, model_product, color):
-    product = Product.objects.get(model_product=model_product, color_cod=color)
+    slug = get_variant_slug(model_product, color)
+    if slug is None:
+        raise Http404('Товар не найден')
+    return redirect('product_detail', slug=slug, permanent=True)
 
-    products = Product.objects.filter(category=product.category)  # Получ список продуктов категории
-    data = []
-    for i in range(len(products)):
-        random_index = randint(0, len(products) - 1)
-        p = products[random_index]
-        if p not in data and product != p:
-            data.append(p)
 
-    context = {
-        'title': f'Товар {product.title}',
-        'product': product,
-        'products': data
-    }
-
-    return render(request, 'digital/product_detail.html', context)
 
+# Функция возвращает id и название товара для избранного, 404 если товара нет
+def get_favorite_product(slug):
+    product = Product.objects.filter(slug=slug).values('pk', 'title').first()
+    if product is None:
+        raise Http404
+    return product
 
 
 # Вьюшка для довления товара в Избранное
 def save_favorite_product(request, slug):
     if request.user.is_authenticated:
-        user = request.user
-        product = Product.objects.get(slug=slug)
-        favorite_products = FavoriteProduct.objects.filter(user=user)
-        if user:
-            if product not in [i.product for i in favorite_products]:
-                messages.success(request, f'Товар {product.title} в избранном')
-                FavoriteProduct.objects.create(user=user, product=product)
-            else:
-                fav_product = FavoriteProduct.objects.get(user=user, product=product)
-                messages.warning(request, f'Товар {product.title} удалён из избранного')
-                fav_product.delete()
+        product = get_favorite_product(slug)
+        if toggle_favorite(request.user, product['pk']):
+            messages.success(request, f'Товар {product["title"]} в избранном')
+        else:
+            messages.warning(request, f'Товар {product["title"]} удалён из избранного')
 
         page = request.META.get('HTTP_REFERER', 'index')
         return redirect(page)
@@ -208,49 +202,86 @@ def save_favorite_product(request, slug):
         return redirect('login')
 
 
+# То же переключение избранного для запроса из JS (favorites.js): ответ JSON вместо редиректа
+@require_POST
+def toggle_favorite_view(request, slug):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Авторизуйтесь, для добавления товара в Избранное'}, status=401)
+    product = get_favorite_product(slug)
+    return JsonResponse({'product_id': product['pk'], 'is_favorite': toggle_favorite(request.user, product['pk'])})
 
 
-class FavoriteProductsView(LoginRequiredMixin, ListView):
+class FavoriteProductsView(LoginRequiredMixin, ProductCardsMixin, ListView):
     model = FavoriteProduct
     context_object_name = 'products'
     template_name = 'digital/favorite.html'
     login_url = 'login'
 
-    # Данным метод отправляет продукты конкретного пользователя на страницу
+    def get_paginate_by(self, queryset):
+        return settings.CATALOG_PAGE_SIZE
+
+    # Постраничный вывод по курсору от последних добавленных. Кол-во избранного берётся из кэша id избранного
+    def paginate_queryset(self, queryset, page_size):
+        count = len(get_favorite_ids(self.request.user))
+        paginator = KeysetPaginator(queryset, page_size, ('-favorited_at', '-pk'), count=count)
+        page = paginator.page(self.request.GET.get('cursor'), parse_int(self.request.GET.get('page')) or 1)
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    # Данным метод отправляет продукты конкретного пользователя на страницу: один JOIN с избранным
+    def get_queryset(self):
+        products = Product.objects.filter(favoriteproduct__user=self.request.user).annotate(
+            favorited_at=F('favoriteproduct__added_at')
+        )
+        return get_card_products(products)
+
+
+# Поиск по товарам: ?q=<запрос>, результаты по релевантности (см. search.py)
+class SearchView(ProductCardsMixin, ListView):
+    context_object_name = 'products'
+    template_name = 'digital/search.html'
+
+    def get_paginate_by(self, queryset):
+        return settings.CATALOG_PAGE_SIZE
+
     def get_queryset(self):
-        user = self.request.user
-        favorite_products = FavoriteProduct.objects.filter(user=user)
-        products = [i.product for i in favorite_products]
-        return products
+        self.query = self.request.GET.get('q', '').strip()
+        return SearchResults(self.query)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['query'] = self.query
+        context['title'] = f'Поиск: {self.query}' if self.query else 'Поиск'
+        return context
+
+
+# Подсказки для строки поиска: ?q=<начало слова> -> {"results": [{"kind", "title", "url"}, ...]}
+def autocomplete_view(request):
+    limit = min(parse_int(request.GET.get('limit')) or settings.AUTOCOMPLETE_LIMIT, settings.AUTOCOMPLETE_LIMIT)
+    return JsonResponse({'results': get_suggestions(request.GET.get('q', ''), max(limit, 1))})
 
 
 # Вьюшка для добавления товара в Корзину
 def to_cart_view(request, pk, action):
-    if request.user.is_authenticated:
-        user_cart = CartForAuthenticatedUser(request, pk, action)
-        page = request.META.get('HTTP_REFERER', 'index')
-        messages.success(request, 'Товар добавлен в корзину')
-        return redirect(page)
+    user_cart = get_cart(request, pk, action)  # Для гостя корзина хранится в сессии
+    page = request.META.get('HTTP_REFERER', 'index')
+    if action == 'add' and not user_cart.updated:
+        messages.warning(request, 'Товара нет в наличии')
     else:
-        messages.warning(request, 'Авторизуйтесь')
-        return redirect(login)
+        messages.success(request, 'Товар добавлен в корзину')
+    return redirect(page)
 
 
 # Вьюшка для страницы корзины
 def my_cart_view(request):
-    if request.user.is_authenticated:
-        cart_info = get_cart_data(request)
+    cart_info = get_cart_data(request)
 
-        context = {
-            'title': 'Моя корзина',
-            'order': cart_info['order'],
-            'products': cart_info['products']
-        }
-
-        return render(request, 'digital/my_cart.html', context)
+    context = {
+        'title': 'Моя корзина',
+        'order': cart_info['order'],
+        'products': cart_info['products']
+    }
 
-    else:
-        return redirect('login')
+    return render(request, 'digital/my_cart.html', context)
 
 
 
@@ -274,57 +305,72 @@ def checkout(request):
 
 
 
-def create_checkout_session(request):
-    stripe.api_key = settings.STRIPE_SECRET_KEY
-    if request.method == 'POST':
-        user_cart = CartForAuthenticatedUser(request)
-        cart_info = user_cart.get_cart_info()
-
-        customer_form = CustomerForm(data=request.POST)
-        if customer_form.is_valid():
-            customer = Customer.objects.get(user=request.user)
-            customer.first_name = customer_form.cleaned_data['first_name']
-            customer.last_name = customer_form.cleaned_data['last_name']
-            customer.email = customer_form.cleaned_data['email']
-            customer.save()
-
-        shipping_form = ShippingForm(data=request.POST)
-        if shipping_form.is_valid():
-            address = shipping_form.save(commit=False)
-            address.customer = Customer.objects.get(user=request.user)
-            address.order = user_cart.get_cart_info()['order']
-            address.save()
+# Сохраняет данные формы оформления заказа (синхронная часть с ORM).
+# Вернёт (заказ, сумма к оплате) или None если оплачивать нечего
+def save_checkout_forms(request):
+    if not request.user.is_authenticated:
+        return None
+    user_cart = CartForAuthenticatedUser(request)
+    cart_info = user_cart.get_cart_info()
+    if not cart_info['cart_total_quantity']:
+        messages.warning(request, 'Корзина пуста')
+        return None
+    customer = request.buyer.customer  # Покупатель и заказ уже найдены для этого запроса
+
+    customer_form = CustomerForm(data=request.POST)
+    if customer_form.is_valid():
+        customer.first_name = customer_form.cleaned_data['first_name']
+        customer.last_name = customer_form.cleaned_data['last_name']
+        customer.email = customer_form.cleaned_data['email']
+        customer.save()
+
+    shipping_form = ShippingForm(data=request.POST)
+    if shipping_form.is_valid():
+        address = shipping_form.save(commit=False)
+        address.customer = customer
+        address.order = cart_info['order']
+        address.save()
 
-        else:
-            for field in shipping_form.errors:
-                messages.warning(request, shipping_form.errors[field].as_text())
-
-
-        total_price = cart_info['cart_total_price']
-        session = stripe.checkout.Session.create(
-            line_items=[{
-                'price_data':{
-                    'currency': 'usd',
-                    'product_data': {
-                        'name': 'DigitalStore товары'
-                    },
-                    'unit_amount': int(total_price)
-                },
-                'quantity': 1
-            }],
-            mode='payment',
-            success_url=request.build_absolute_uri(reverse('success')),
-            cancel_url=request.build_absolute_uri(reverse('checkout'))
+    else:
+        for field in shipping_form.errors:
+            messages.warning(request, shipping_form.errors[field].as_text())
+
+    # Пока идёт оплата товары корзины остаются за покупателем
+    if not hold_order(cart_info['order'], settings.STOCK_CHECKOUT_HOLD_TTL):
+        messages.warning(request, 'Части товаров больше нет в наличии, корзина обновлена')
+        return None
+    amount = get_amount(cart_info['cart_total_price'])
+    set_payment_amount(cart_info['order'], amount)  # С этой суммой webhook сверит оплату
+    return cart_info['order'], amount
+
+
+# Асинхронная вьюшка оплаты: пока платёжная система отвечает, воркер (ASGI) обслуживает другие запросы
+async def create_checkout_session(request):
+    if request.method != 'POST':
+        return redirect('checkout')
+    checkout_data = await sync_to_async(save_checkout_forms)(request)
+    if checkout_data is None:
+        return redirect('checkout')
+
+    order, amount = checkout_data
+    try:
+        session = await asyncio.wait_for(
+            get_gateway().create_checkout_session(
+                order, amount,
+                success_url=request.build_absolute_uri(reverse('success')),
+                cancel_url=request.build_absolute_uri(reverse('checkout'))
+            ),
+            timeout=settings.PAYMENT_TIMEOUT * (settings.PAYMENT_MAX_RETRIES + 1)
         )
-        return redirect(session.url, 303)
+    except (PaymentError, asyncio.TimeoutError):
+        messages.warning(request, 'Платёжная система не отвечает, попробуйте ещё раз')
+        return redirect('checkout')
+    return HttpResponseRedirect(session.url, status=303)
 
 
+# Страница после оплаты только показывает результат: заказ завершает webhook платёжной системы
 def success_payment(request):
     if request.user.is_authenticated:
-        user_cart = CartForAuthenticatedUser(request)
-        # Реализовать логику сохранения заказа после оплаты
-
-        user_cart.clear()
         messages.success(request, 'Оплата прошла успешно. Мы вас кинули спаибо покупайте ещё.')
         return render(request, 'digital/success.html')
 
@@ -332,18 +378,25 @@ def success_payment(request):
         return redirect('index')
 
 
+# Webhook Stripe: проверяем подпись, кладём событие в очередь и сразу отвечаем 200
+@csrf_exempt
+@require_POST
+def payment_webhook(request):
+    try:
+        stripe.Webhook.construct_event(
+            request.body, request.headers.get('Stripe-Signature', ''), settings.STRIPE_WEBHOOK_SECRET
+        )
+    except (ValueError, stripe.SignatureVerificationError):
+        return HttpResponse(status=400)
 
-def clear_cart(request):
-    user_cart = CartForAuthenticatedUser(request)
-    order = user_cart.get_cart_info()['order']
-    order_products = order.orderproduct_set.all()
-    for order_product in order_products:
-        quantity = order_product.quantity
-        product = order_product.product
-        order_product.delete()
-        product.quantity += quantity
-        product.save()
+    receive_event(json.loads(request.body))
+    return HttpResponse(status=200)
 
+
+
+# Очистка корзины: резервы товаров снимаются (см. CartForAuthenticatedUser.clear)
+def clear_cart(request):
+    get_cart(request).clear()
     return redirect('my_cart')
 
 
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -48,6 +49,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'digital.middleware.BuyerMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -66,6 +68,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'digital.context_processors.buyer',
             ],
         },
     },
@@ -80,8 +83,38 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Транзакции сразу берут блокировку на запись, одновременные изменения корзины ждут друг друга
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # Тестовая база в файле, чтобы тесты с потоками работали как настоящая база
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+# Кэш должен быть общим для всех воркеров (gunicorn/uwsgi): данные сбрасываются увеличением версии ключа
+# (digital/cache.py), и в кэше отдельного процесса (LocMemCache) версию увидел бы только воркер,
+# где сработал сигнал. Для разработки файловый кэш (общий для процессов на одном сервере), он хранит
+# до CACHE_MAX_ENTRIES ключей и при каждой записи читает список файлов, поэтому без DEBUG нужен
+# Redis: CACHE_BACKEND=django.core.cache.backends.redis.RedisCache CACHE_LOCATION=redis://...
+# Тесты работают с кэшем в памяти (shop/test_runner.py)
+FILE_CACHE_BACKEND = 'django.core.cache.backends.filebased.FileBasedCache'
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default=FILE_CACHE_BACKEND),
+        'LOCATION': config('CACHE_LOCATION', default=str(BASE_DIR / 'var' / 'cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=50_000, cast=int),
+        },
     }
 }
+if not DEBUG and CACHES['default']['BACKEND'] == FILE_CACHE_BACKEND:
+    raise ImproperlyConfigured('Без DEBUG нужен общий кэш Redis или Memcached: задайте CACHE_BACKEND и CACHE_LOCATION')
+
+TEST_RUNNER = 'shop.test_runner.TestRunner'
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -121,9 +154,28 @@ STATICFILES_DIRS = [  # Указали где будут лежать стати
     BASE_DIR / 'digital/static'
 ]
 
+# Сборка статики (python manage.py build_static): один CSS, шрифты WOFF2, хэш в именах файлов
+# и сжатые .gz/.br копии. На сервере включается переменной окружения STATIC_BUILD=True
+STATIC_BUILD = config('STATIC_BUILD', default=False, cast=bool)
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'digital.storage.CompressedManifestStaticFilesStorage' if STATIC_BUILD
+        else 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Уменьшенные копии картинок товаров и категорий (см. digital/images.py)
+IMAGE_VARIANTS_ASYNC = True  # Создавать копии в пуле потоков после сохранения
+IMAGE_WORKERS = 2
+IMAGE_QUALITY = 80
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -142,3 +194,55 @@ MESSAGE_TAGS = {
 STRIPE_PUBLIC_KEY = config('STRIPE_PUBLIC_KEY')
 
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY')
+
+# Платёжный шлюз (digital/payments.py). Для разработки и нагрузочных тестов без Stripe:
+# PAYMENT_GATEWAY=digital.payments.FakeGateway
+PAYMENT_GATEWAY = config('PAYMENT_GATEWAY', default='digital.payments.StripeGateway')
+# Валюта цен каталога (сум). Stripe считает UZS в сотых долях (тийинах), см. payments.get_amount
+PAYMENT_CURRENCY = config('PAYMENT_CURRENCY', default='uzs')
+PAYMENT_TIMEOUT = 10  # Секунд на один запрос к платёжной системе
+PAYMENT_MAX_RETRIES = 2  # Повторы при сетевых ошибках, с тем же ключом идемпотентности
+PAYMENT_FAKE_DELAY = config('PAYMENT_FAKE_DELAY', default=0, cast=float)  # Задержка ответа FakeGateway
+
+# Секрет подписи webhook Stripe (Dashboard -> Developers -> Webhooks) и сколько раз
+# команда process_payment_events пробует обработать событие с ошибкой
+STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET', default='')
+PAYMENT_EVENT_MAX_ATTEMPTS = 5
+
+# Резервы товара (stock.py): сколько секунд корзина держит товар после добавления, на сколько резерв
+# продлевается при переходе к оплате и сколько резервов команда release_expired_holds снимает за одну транзакцию
+STOCK_HOLD_TTL = 60 * 30
+STOCK_CHECKOUT_HOLD_TTL = 60 * 60
+STOCK_SWEEP_BATCH_SIZE = 500
+
+# Шаг ценовых диапазонов в фильтре категории (сум)
+FACET_PRICE_STEP = 1_000_000
+
+# Кол-во товаров на странице категории и максимум который можно запросить через ?per_page=
+CATALOG_PAGE_SIZE = 20
+CATALOG_MAX_PAGE_SIZE = 100
+
+# Сколько секунд хранится в кэше кол-во товаров для номеров страниц
+CATALOG_COUNT_CACHE_TIMEOUT = 300
+
+# Блок "Похожие товары": сколько показывать, из скольких товаров категории выбирать и сколько секунд хранить пул
+RELATED_PRODUCTS_LIMIT = 8
+RELATED_POOL_SIZE = 500
+RELATED_PRODUCTS_CACHE_TIMEOUT = 60
+
+# Сколько секунд хранятся данные каталога в кэше (дерево категорий и т.п.), сбрасываются они сигналами
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Сколько секунд хранится множество id избранных товаров пользователя. Сбрасывается сигналами в общем кэше (CACHES),
+# короткий срок ограничивает устаревание, если кэш всё же не общий (LocMemCache у каждого воркера свой)
+FAVORITES_CACHE_TIMEOUT = 60 * 5
+
+# Новинки на главной: сколько последних товаров брать из каждой категории и сколько всего показывать
+NEW_ARRIVALS_PER_CATEGORY = 4
+NEW_ARRIVALS_LIMIT = 20
+
+# Подсказки поиска: файл-снимок (общий для всех процессов через mmap), кол-во подсказок
+# и сколько ключей просматривается на один префикс
+AUTOCOMPLETE_SNAPSHOT = BASE_DIR / 'var' / 'autocomplete.idx'
+AUTOCOMPLETE_LIMIT = 8
+AUTOCOMPLETE_SCAN_LIMIT = 500
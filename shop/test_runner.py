@@ -0,0 +1,24 @@
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+# Тесты не трогают кэш (var/cache) и медиа (media) разработчика: кэш в памяти процесса, медиа во временной папке.
+# Копии картинок создаются сразу, без пула потоков, чтобы потоки не переживали тест
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.media_root = tempfile.mkdtemp()
+        self.test_settings = override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+            MEDIA_ROOT=self.media_root,
+            IMAGE_VARIANTS_ASYNC=False,
+        )
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)